@@ -0,0 +1,83 @@
+import numpy as np
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import QgsFeatureRequest, NULL
+
+
+def column_dtype(field):
+    # NumPy type for a QGIS field: doubles as float64, other numeric fields
+    # as int64, booleans as bool and everything else (text, dates) as object
+    if field.type() == QVariant.Double:
+        return np.float64
+    if field.type() == QVariant.Bool:
+        return np.bool_
+    if field.isNumeric():
+        return np.int64
+    return object
+
+
+def to_array(values, dtype):
+    # One chunk of attribute values as (array, mask), mask True where the
+    # value is NULL or cannot be converted to dtype. Masked floats are NaN.
+    mask = np.fromiter((value is None or value == NULL for value in values), dtype=bool, count=len(values))
+    if dtype is object:
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        array[mask] = None
+        return array, mask
+    fill = np.zeros(1, dtype=dtype)[0]
+    try:
+        array = np.array([fill if null else value for value, null in zip(values, mask)], dtype=dtype)
+    except (TypeError, ValueError):
+        # e.g. numbers stored as text, converted one by one
+        array = np.zeros(len(values), dtype=dtype)
+        for i, value in enumerate(values):
+            if not mask[i]:
+                try:
+                    array[i] = value
+                except (TypeError, ValueError):
+                    mask[i] = True
+    if array.dtype.kind == 'f':
+        mask |= np.isnan(array)
+        array[mask] = np.nan
+    return array, mask
+
+
+def read_columns(source, names, dtypes=None, chunk_size=65536, feedback=None):
+    # The named fields of a feature source as {name: (array, mask)}. Only
+    # these attributes are requested and no geometry, values are copied in
+    # chunks of chunk_size features into typed arrays, see column_dtype.
+    # dtypes overrides the type per field, e.g. {'pop': np.float64}.
+    fields = source.fields()
+    indices = [fields.lookupField(name) for name in names]
+    for name, index in zip(names, indices):
+        if index == -1:
+            raise KeyError(f"Field {name} not found")
+    types = [(dtypes or {}).get(name, column_dtype(fields.at(index))) for name, index in zip(names, indices)]
+
+    request = QgsFeatureRequest()
+    request.setFlags(QgsFeatureRequest.NoGeometry)
+    request.setSubsetOfAttributes(indices)
+
+    total = source.featureCount()
+    chunks = [[] for _ in names]
+    values = [[] for _ in names]
+    count = 0
+    for feature in source.getFeatures(request):
+        attributes = feature.attributes()
+        for column, index in zip(values, indices):
+            column.append(attributes[index])
+        count += 1
+        if count % chunk_size == 0:
+            for chunk, column, dtype in zip(chunks, values, types):
+                chunk.append(to_array(column, dtype))
+                column.clear()
+            if feedback is not None:
+                if feedback.isCanceled():
+                    break
+                if total > 0:
+                    feedback.setProgress(int(count / total * 100))
+    for chunk, column, dtype in zip(chunks, values, types):
+        chunk.append(to_array(column, dtype))
+
+    return {name: (np.concatenate([array for array, _ in chunk]), np.concatenate([mask for _, mask in chunk]))
+            for name, chunk in zip(names, chunks)}
@@ -1,38 +1,368 @@
-from qgis.core import QgsVectorLayer, QgsFeature, QgsGeometry, QgsPointXY, QgsFields, QgsField, QgsWkbTypes
-from qgis.PyQt.QtCore import QVariant
-
-layer = iface.activeLayer()
-
-sum_x = 0
-sum_y = 0
-count = 0
-
-for feature in layer.getFeatures():
-    geom = feature.geometry()
-    if geom.isMultipart():
-        points = geom.asMultiPoint()
-    else:
-        points = [geom.asPoint()]
-    for point in points:
-        sum_x += point.x()
-        sum_y += point.y()
-        count += 1
-      
-mean_x = sum_x / count
-mean_y = sum_y / count
-centroid_point = QgsGeometry.fromPointXY(QgsPointXY(mean_x, mean_y))
-
-crs = layer.crs().authid()  
-new_layer = QgsVectorLayer(f"Point?crs={crs}", "Centroid Layer", "memory")
-new_layer_data_provider = new_layer.dataProvider()
-new_layer_data_provider.addAttributes([QgsField("id", QVariant.Int)])
-new_layer.updateFields()
-new_feature = QgsFeature()
-new_feature.setGeometry(centroid_point)
-new_feature.setAttributes([1])
-new_layer_data_provider.addFeature(new_feature)
-new_layer.updateExtents()
-
-QgsProject.instance().addMapLayer(new_layer)
-
-print(f"New layer 'Centroid Layer' created withcentroid at: ({mean_x}, {mean_y})")
+import numpy as np
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsFeature,
+                       QgsFeatureRequest,
+                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsPointXY,
+                       QgsWkbTypes,
+                       QgsCoordinateTransform,
+                       QgsCsException,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterFeatureSource,
+                       QgsProcessingParameterField,
+                       QgsProcessingParameterRasterLayer,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSink)
+
+
+class CenterSums:
+    # Per group n, sum of w, w*x and w*y of a set of points. Partials of
+    # partitions merge exactly and update() can be called again as points
+    # are appended. Coordinates are summed relative to an origin and the
+    # running sums are Neumaier compensated, so large projected
+    # coordinates (EPSG:3857) do not lose precision.
+
+    def __init__(self):
+        self.origin = None
+        self.index = {}
+        self.names = []
+        self.count = np.zeros(0, dtype=np.int64)
+        self.sums = np.zeros((3, 0))
+        self.compensation = np.zeros((3, 0))
+
+    def indices(self, names):
+        new = [name for name in names if name not in self.index]
+        for name in new:
+            self.index[name] = len(self.names)
+            self.names.append(name)
+        if new:
+            self.count = np.concatenate([self.count, np.zeros(len(new), dtype=np.int64)])
+            self.sums = np.hstack([self.sums, np.zeros((3, len(new)))])
+            self.compensation = np.hstack([self.compensation, np.zeros((3, len(new)))])
+        return np.array([self.index[name] for name in names], dtype=np.int64)
+
+    def accumulate(self, rows, values, count):
+        total = self.sums[:, rows]
+        result = total + values
+        self.compensation[:, rows] += np.where(np.abs(total) >= np.abs(values),
+                                               (total - result) + values, (values - result) + total)
+        self.sums[:, rows] = result
+        self.count[rows] += count
+
+    def update(self, labels, x, y, w):
+        if not len(x):
+            return
+        if self.origin is None:
+            self.origin = (float(x[0]), float(y[0]))
+        names, groups = np.unique(labels, return_inverse=True)
+        size = len(names)
+        values = np.vstack([np.bincount(groups, weights=w, minlength=size),
+                            np.bincount(groups, weights=w * (x - self.origin[0]), minlength=size),
+                            np.bincount(groups, weights=w * (y - self.origin[1]), minlength=size)])
+        self.accumulate(self.indices(list(names)), values, np.bincount(groups, minlength=size))
+
+    def merge(self, other):
+        if other.origin is None:
+            return self
+        if self.origin is None:
+            self.origin = other.origin
+        # Move the other partial to this origin before adding it
+        values = other.sums + other.compensation
+        values[1] += values[0] * (other.origin[0] - self.origin[0])
+        values[2] += values[0] * (other.origin[1] - self.origin[1])
+        self.accumulate(self.indices(other.names), values, other.count)
+        return self
+
+    def centers(self):
+        total = self.sums + self.compensation
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (self.names, self.origin[0] + total[1] / total[0], self.origin[1] + total[2] / total[0],
+                    self.count, total[0])
+
+
+class CenterOfPointsAlgorithm(QgsProcessingAlgorithm):
+    INPUT = 'INPUT'
+    WEIGHT_FIELD = 'WEIGHT_FIELD'
+    WEIGHT_RASTER = 'WEIGHT_RASTER'
+    GROUP_FIELD = 'GROUP_FIELD'
+    METHOD = 'METHOD'
+    OUTPUT = 'OUTPUT'
+
+    BATCH_SIZE = 100000
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return CenterOfPointsAlgorithm()
+
+    def name(self):
+        return 'centerofpoints'
+
+    def displayName(self):
+        return self.tr('Center of points')
+
+    def group(self):
+        return self.tr('Facilities')
+
+    def groupId(self):
+        return 'facilityscripts'
+
+    def shortHelpString(self):
+        return self.tr("Mean center or geometric median of a point layer, optionally weighted by a numeric field "
+                       "or by the value of a raster (e.g. GHSL population) at each point, and optionally one "
+                       "center per value of a group field (e.g. country or municipality).")
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterFeatureSource(
+                self.INPUT,
+                self.tr('Input layer'),
+                [QgsProcessing.TypeVectorPoint]
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.WEIGHT_FIELD,
+                self.tr('Weight field'),
+                parentLayerParameterName=self.INPUT,
+                type=QgsProcessingParameterField.Numeric,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterRasterLayer(
+                self.WEIGHT_RASTER,
+                self.tr('Weight raster'),
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterField(
+                self.GROUP_FIELD,
+                self.tr('Group field'),
+                parentLayerParameterName=self.INPUT,
+                optional=True
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.METHOD,
+                self.tr('Method'),
+                options=['Mean center', 'Geometric median'],
+                defaultValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Center')
+            )
+        )
+
+    @staticmethod
+    def wkb_coordinates(wkbs):
+        # x, y of a batch of point WKBs. Plain points (21 bytes, or 29 with
+        # z/m) are decoded in one np.frombuffer, anything else (multipoints)
+        # vertex by vertex. Returns the coordinates and the index of the
+        # feature each one belongs to.
+        lengths = {len(wkb) for wkb in wkbs}
+        if len(lengths) == 1 and lengths <= {21, 29} and all(wkb[0] == 1 for wkb in wkbs):
+            size = lengths.pop()
+            records = np.frombuffer(b''.join(wkbs), dtype=np.uint8).reshape(-1, size)
+            xy = records[:, 5:21].copy().view('<f8')
+            return xy[:, 0], xy[:, 1], np.arange(len(wkbs))
+        xs, ys, index = [], [], []
+        for i, wkb in enumerate(wkbs):
+            geometry = QgsGeometry()
+            geometry.fromWkb(wkb)
+            for vertex in geometry.vertices():
+                xs.append(vertex.x())
+                ys.append(vertex.y())
+                index.append(i)
+        return np.array(xs, dtype=np.float64), np.array(ys, dtype=np.float64), np.array(index, dtype=np.int64)
+
+    @staticmethod
+    def sample_raster(raster_layer, x, y):
+        # Raster values at the points, read one raster block at a time, so
+        # memory stays at one block however far apart the points are.
+        # Points outside the raster, on nodata or with NaN coordinates weigh 0.
+        from osgeo import gdal
+        dataset = gdal.Open(raster_layer.source())
+        band = dataset.GetRasterBand(1)
+        x0, dx, _, y0, _, dy = dataset.GetGeoTransform()
+        finite = np.isfinite(x) & np.isfinite(y)
+        cols = np.floor((np.where(finite, x, x0) - x0) / dx).astype(np.int64)
+        rows = np.floor((np.where(finite, y, y0) - y0) / dy).astype(np.int64)
+        inside = finite & (cols >= 0) & (cols < dataset.RasterXSize) & (rows >= 0) & (rows < dataset.RasterYSize)
+        weights = np.zeros(len(x))
+        nodata = band.GetNoDataValue()
+        block_width, block_height = band.GetBlockSize()
+        blocks_per_row = -(-dataset.RasterXSize // block_width)
+
+        # Points sorted by the block they fall in, one read per block
+        points = np.flatnonzero(inside)
+        blocks = rows[points] // block_height * blocks_per_row + cols[points] // block_width
+        order = np.argsort(blocks, kind='stable')
+        points, blocks = points[order], blocks[order]
+        starts = np.flatnonzero(np.r_[True, blocks[1:] != blocks[:-1]]) if points.size else np.empty(0, dtype=np.int64)
+        for part in np.split(points, starts[1:]) if points.size else []:
+            r0 = rows[part[0]] // block_height * block_height
+            c0 = cols[part[0]] // block_width * block_width
+            height = min(block_height, dataset.RasterYSize - r0)
+            width = min(block_width, dataset.RasterXSize - c0)
+            values = band.ReadAsArray(int(c0), int(r0), int(width), int(height)).astype(np.float64)
+            sampled = values[rows[part] - r0, cols[part] - c0]
+            if nodata is not None:
+                sampled[sampled == nodata] = 0
+            weights[part] = np.nan_to_num(sampled)
+        return weights
+
+    @staticmethod
+    def transform_coordinates(transform, x, y):
+        # x, y through a QgsCoordinateTransform, NaN where it fails
+        tx, ty = np.full(len(x), np.nan), np.full(len(y), np.nan)
+        for i in range(len(x)):
+            try:
+                point = transform.transform(QgsPointXY(x[i], y[i]))
+            except QgsCsException:
+                continue
+            tx[i], ty[i] = point.x(), point.y()
+        return tx, ty
+
+    @staticmethod
+    def mean_center(groups, x, y, w, ngroups):
+        total = np.bincount(groups, weights=w, minlength=ngroups)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return (np.bincount(groups, weights=w * x, minlength=ngroups) / total,
+                    np.bincount(groups, weights=w * y, minlength=ngroups) / total)
+
+    @staticmethod
+    def geometric_median(groups, x, y, w, ngroups, tolerance=1e-7, iterations=200):
+        # Weiszfeld's algorithm for all groups at once, starting from the
+        # mean centers. Stops when no center moves more than tolerance times
+        # the spread of the points.
+        cx, cy = CenterOfPointsAlgorithm.mean_center(groups, x, y, w, ngroups)
+        scale = max(np.ptp(x) if len(x) else 0, np.ptp(y) if len(y) else 0, 1e-12)
+        for _ in range(iterations):
+            distance = np.hypot(x - cx[groups], y - cy[groups])
+            inverse = w / np.maximum(distance, scale * 1e-12)
+            nx, ny = CenterOfPointsAlgorithm.mean_center(groups, x, y, inverse, ngroups)
+            shift = np.nanmax(np.hypot(nx - cx, ny - cy)) if ngroups else 0
+            cx, cy = nx, ny
+            if shift <= tolerance * scale:
+                break
+        return cx, cy
+
+    def read_points(self, source, request, weight_field, group_field, weight_raster, to_raster, feedback):
+        # Batches of (labels, x, y, w) of the valid, positively weighted
+        # points the request returns. x, y stay in the source CRS, only the
+        # coordinates the raster is sampled at go through to_raster if it is
+        # not None.
+        wkbs, values, labels = [], [], []
+        total = source.featureCount() or 1
+
+        def batch():
+            x, y, index = CenterOfPointsAlgorithm.wkb_coordinates(wkbs)
+            w = np.ones(len(x))
+            if weight_field:
+                w = np.array([np.nan if value is None else value for value in values], dtype=np.float64)[index]
+            if weight_raster is not None:
+                rx, ry = (x, y) if to_raster is None else CenterOfPointsAlgorithm.transform_coordinates(to_raster, x, y)
+                w = w * CenterOfPointsAlgorithm.sample_raster(weight_raster, rx, ry)
+            group = np.array(labels, dtype=object)[index] if group_field else np.zeros(len(x), dtype=np.int64)
+            valid = np.isfinite(w) & (w > 0) & np.isfinite(x) & np.isfinite(y)
+            wkbs.clear()
+            values.clear()
+            labels.clear()
+            return group[valid], x[valid], y[valid], w[valid]
+
+        for current, feature in enumerate(source.getFeatures(request)):
+            if feedback.isCanceled():
+                return
+            geometry = feature.geometry()
+            if geometry.isEmpty():
+                continue
+            wkbs.append(bytes(geometry.asWkb()))
+            if weight_field:
+                value = feature[weight_field]
+                values.append(value if isinstance(value, (int, float)) else None)
+            if group_field:
+                labels.append(str(feature[group_field]))
+            if len(wkbs) == self.BATCH_SIZE:
+                feedback.setProgress(int(current / total * 90))
+                yield batch()
+        if wkbs:
+            yield batch()
+
+    def processAlgorithm(self, parameters, context, feedback):
+        source = self.parameterAsSource(parameters, self.INPUT, context)
+        weight_field = self.parameterAsString(parameters, self.WEIGHT_FIELD, context)
+        weight_raster = self.parameterAsRasterLayer(parameters, self.WEIGHT_RASTER, context)
+        group_field = self.parameterAsString(parameters, self.GROUP_FIELD, context)
+        method = self.parameterAsEnum(parameters, self.METHOD, context)
+
+        # Centers are computed in the source CRS, a weight raster in another
+        # CRS is sampled at the points transformed to the raster CRS
+        to_raster = None
+        if weight_raster is not None and weight_raster.crs() != source.sourceCrs():
+            to_raster = QgsCoordinateTransform(source.sourceCrs(), weight_raster.crs(), context.transformContext())
+
+        # Geometry plus only the weight and group attributes
+        request = QgsFeatureRequest()
+        attributes = [name for name in (weight_field, group_field) if name]
+        if attributes:
+            request.setSubsetOfAttributes(attributes, source.fields())
+        else:
+            request.setNoAttributes()
+
+        # The mean center only needs the CenterSums, the geometric median
+        # needs the points themselves
+        batches = self.read_points(source, request, weight_field, group_field, weight_raster, to_raster, feedback)
+        if method == 0:
+            sums = CenterSums()
+            for batch in batches:
+                sums.update(*batch)
+        else:
+            batches = list(batches)
+        if feedback.isCanceled():
+            return {}
+
+        if method == 0:
+            if sums.origin is None:
+                raise QgsProcessingException(self.tr('No points found in the input layer'))
+            names, cx, cy, counts, weights = sums.centers()
+        else:
+            if not batches:
+                raise QgsProcessingException(self.tr('No points found in the input layer'))
+            labels, x, y, w = (np.concatenate(column) for column in zip(*batches))
+            names, group = np.unique(labels, return_inverse=True)
+            cx, cy = CenterOfPointsAlgorithm.geometric_median(group, x, y, w, len(names))
+            counts = np.bincount(group, minlength=len(names))
+            weights = np.bincount(group, weights=w, minlength=len(names))
+
+        feedback.pushInfo(f"Points: {int(np.sum(counts))}, groups: {len(names)}")
+
+        fields = QgsFields()
+        if group_field:
+            fields.append(QgsField(group_field, QVariant.String))
+        fields.append(QgsField('count', QVariant.Int))
+        fields.append(QgsField('weight', QVariant.Double))
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context,
+                                               fields, QgsWkbTypes.Point, source.sourceCrs())
+        for i, name in enumerate(names):
+            if not counts[i]:
+                continue
+            feat = QgsFeature(fields)
+            feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(cx[i], cy[i])))
+            feat.setAttributes(([str(name)] if group_field else []) + [int(counts[i]), float(weights[i])])
+            sink.addFeature(feat, QgsFeatureSink.FastInsert)
+
+        feedback.setProgress(100)
+        return {self.OUTPUT: dest_id}
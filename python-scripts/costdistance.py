@@ -0,0 +1,367 @@
+import heapq
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import dijkstra
+
+# 8-connected neighbourhood, diagonal steps are sqrt(2) cells long
+NEIGHBOURS = [(-1, -1), (-1, 0), (-1, 1), (0, -1), (0, 1), (1, -1), (1, 0), (1, 1)]
+SQRT2 = np.sqrt(2.0)
+
+# Memory maps of the current worker process, see open_tiled
+tiled = {}
+
+
+def pixel_edges(friction, cell_size):
+    # Edge cost between two neighbouring pixels is the mean friction of both
+    # pixels times the step length. NaN friction is a barrier.
+    rows, cols = friction.shape
+    index = np.arange(rows * cols).reshape(rows, cols)
+    valid = np.isfinite(friction)
+    heads, tails, weights = [], [], []
+    for dr, dc in NEIGHBOURS:
+        step = cell_size * SQRT2 if dr and dc else cell_size
+        src = (slice(max(0, -dr), rows - max(0, dr)), slice(max(0, -dc), cols - max(0, dc)))
+        dst = (slice(max(0, dr), rows - max(0, -dr)), slice(max(0, dc), cols - max(0, -dc)))
+        keep = valid[src] & valid[dst]
+        heads.append(index[src][keep])
+        tails.append(index[dst][keep])
+        weights.append((friction[src][keep] + friction[dst][keep]) / 2 * step)
+    return np.concatenate(heads), np.concatenate(tails), np.concatenate(weights)
+
+
+def solve_seeded(friction, seed_cost, seed_alloc, cell_size):
+    # Multi-source Dijkstra over a friction window. Every pixel with a finite
+    # seed_cost is a source that starts at that cost, which covers fresh runs
+    # (facilities at 0) as well as resuming from known costs.
+    # Returns the accumulated cost and, per pixel, the seed_alloc id of the
+    # seed it was reached from (-1 if unreachable).
+    rows, cols = friction.shape
+    n = rows * cols
+    friction = np.asarray(friction, dtype=np.float64)
+    seed_cost = np.asarray(seed_cost, dtype=np.float64).ravel()
+    seed_alloc = np.asarray(seed_alloc).ravel()
+
+    heads, tails, weights = pixel_edges(friction, cell_size)
+
+    # A virtual super source (node n) is linked to every seed with the seed's
+    # starting cost, so one Dijkstra run handles all sources at once.
+    seeds = np.flatnonzero(np.isfinite(seed_cost))
+    heads = np.concatenate([heads, np.full(seeds.size, n)])
+    tails = np.concatenate([tails, seeds])
+    weights = np.concatenate([weights, seed_cost[seeds]])
+
+    graph = csr_matrix((weights, (heads, tails)), shape=(n + 1, n + 1))
+    dist, pred = dijkstra(graph, directed=True, indices=n, return_predecessors=True)
+
+    cost = dist[:n]
+    reached = np.isfinite(cost)
+
+    # Follow the predecessor tree back to the seed each pixel hangs off,
+    # halving the remaining path on every pass.
+    parent = pred[:n].astype(np.int64)
+    roots = (parent == n) | (parent < 0)
+    parent[roots] = np.flatnonzero(roots)
+    while True:
+        grand = parent[parent]
+        if np.array_equal(grand, parent):
+            break
+        parent = grand
+
+    allocation = np.where(reached, seed_alloc[parent], -1).astype(np.int32)
+    cost = np.where(reached, cost, np.nan)
+    return cost.reshape(rows, cols), allocation.reshape(rows, cols)
+
+
+def source_ids(source_rows, ids=None):
+    # Allocation id of every source, its position unless ids are given
+    if ids is None:
+        return np.arange(len(source_rows), dtype=np.int32)
+    return np.asarray(ids, dtype=np.int32)
+
+
+def accumulated_cost(friction, source_rows, source_cols, cell_size, ids=None):
+    # Cost from the nearest source for every pixel plus the id of that
+    # source (see source_ids). Several sources in one pixel are allocated to
+    # the lowest id.
+    seed_cost = np.full(friction.shape, np.inf)
+    seed_alloc = np.full(friction.shape, np.iinfo(np.int32).max, dtype=np.int32)
+    ids = source_ids(source_rows, ids)
+    np.minimum.at(seed_alloc, (source_rows, source_cols), ids)
+    seed_cost[source_rows, source_cols] = 0.0
+    seed_alloc[~np.isfinite(seed_cost)] = -1
+    return solve_seeded(friction, seed_cost, seed_alloc, cell_size)
+
+
+def tile_bounds(shape, tile_size):
+    rows, cols = shape
+    return {(i, j): (r, min(r + tile_size, rows), c, min(c + tile_size, cols))
+            for i, r in enumerate(range(0, rows, tile_size))
+            for j, c in enumerate(range(0, cols, tile_size))}
+
+
+def halo_bounds(bounds, shape):
+    r0, r1, c0, c1 = bounds
+    return max(r0 - 1, 0), min(r1 + 1, shape[0]), max(c0 - 1, 0), min(c1 + 1, shape[1])
+
+
+def solve_tile(friction, cost, allocation, bounds, cell_size):
+    # Re-solve one tile seeded with the current costs inside it and in a one
+    # pixel halo around it. Returns the mask of improved pixels and the new
+    # cost and allocation of the tile itself (the halo is left alone).
+    r0, r1, c0, c1 = bounds
+    h0, h1, w0, w1 = halo_bounds(bounds, cost.shape)
+    window = (slice(h0, h1), slice(w0, w1))
+    inner = (slice(r0 - h0, r1 - h0), slice(c0 - w0, c1 - w0))
+
+    old_cost = np.array(cost[window])
+    old_alloc = np.array(allocation[window])
+    new_cost, new_alloc = solve_seeded(np.array(friction[window]), old_cost, old_alloc, cell_size)
+
+    improved = new_cost[inner] < old_cost[inner]
+    tile_cost = np.where(improved, new_cost[inner], old_cost[inner])
+    tile_alloc = np.where(improved, new_alloc[inner], old_alloc[inner])
+    return improved, tile_cost, tile_alloc
+
+
+def relax_tile(friction, cost, allocation, bounds, cell_size):
+    improved, tile_cost, tile_alloc = solve_tile(friction, cost, allocation, bounds, cell_size)
+    if improved.any():
+        r0, r1, c0, c1 = bounds
+        cost[r0:r1, c0:c1] = tile_cost
+        allocation[r0:r1, c0:c1] = tile_alloc
+    return improved
+
+
+def neighbour_keys(tile, bounds, improved, cost, tiles):
+    # Lowest improved cost inside the halo of each neighbouring tile, i.e. the
+    # priority with which that neighbour has to be relaxed again.
+    r0, r1, c0, c1 = bounds
+    keys = {}
+    for di, dj in NEIGHBOURS:
+        neighbour = (tile[0] + di, tile[1] + dj)
+        if neighbour not in tiles:
+            continue
+        h0, h1, w0, w1 = halo_bounds(tiles[neighbour], cost.shape)
+        rs = slice(max(h0, r0) - r0, min(h1, r1) - r0)
+        cs = slice(max(w0, c0) - c0, min(w1, c1) - c0)
+        touched = improved[rs, cs]
+        if touched.any():
+            keys[neighbour] = np.array(cost[r0:r1, c0:c1][rs, cs])[touched].min()
+    return keys
+
+
+def init_tiled(shape, source_rows, source_cols, workdir, tile_size, ids=None):
+    # Cost and allocation memmaps with the sources seeded, the tile layout and
+    # the tiles that have to be relaxed first
+    tiles = tile_bounds(shape, tile_size)
+    cost = np.lib.format.open_memmap(os.path.join(workdir, 'cost.npy'), mode='w+', dtype=np.float64, shape=shape)
+    allocation = np.lib.format.open_memmap(os.path.join(workdir, 'allocation.npy'), mode='w+', dtype=np.int32, shape=shape)
+    for r0, r1, c0, c1 in tiles.values():
+        cost[r0:r1, c0:c1] = np.inf
+        allocation[r0:r1, c0:c1] = -1
+
+    # Several sources in one pixel are allocated to the lowest id
+    ids = source_ids(source_rows, ids)
+    order = np.argsort(ids, kind='stable')
+    pixels = np.asarray(source_rows)[order] * shape[1] + np.asarray(source_cols)[order]
+    pixels, first = np.unique(pixels, return_index=True)
+    seed_rows, seed_cols = np.divmod(pixels, shape[1])
+    cost[seed_rows, seed_cols] = 0.0
+    allocation[seed_rows, seed_cols] = ids[order][first]
+
+    # A seed on a tile edge also sits in the halo of the neighbouring tiles
+    pending = {}
+    for r, c in zip(seed_rows, seed_cols):
+        for dr, dc in NEIGHBOURS + [(0, 0)]:
+            tile = ((r + dr) // tile_size, (c + dc) // tile_size)
+            if tile in tiles:
+                pending[(int(tile[0]), int(tile[1]))] = 0.0
+    return cost, allocation, tiles, pending
+
+
+def accumulated_cost_tiled(friction, source_rows, source_cols, cell_size, workdir, tile_size=512, ids=None):
+    # Out-of-core variant of accumulated_cost. friction may be a memmap; cost
+    # and allocation live in .npy memmaps in workdir. Tiles are relaxed in
+    # order of their lowest pending cost, so only tiles the wavefront reaches
+    # are paged in and memory stays at one tile window plus one key per tile.
+    # The result is the same fixed point as the in-memory solve.
+    cost, allocation, tiles, pending = init_tiled(friction.shape, source_rows, source_cols, workdir, tile_size, ids)
+    queue = [(key, tile) for tile, key in pending.items()]
+    heapq.heapify(queue)
+
+    while queue:
+        key, tile = heapq.heappop(queue)
+        if pending.get(tile) != key:
+            continue
+        del pending[tile]
+        improved = relax_tile(friction, cost, allocation, tiles[tile], cell_size)
+        for neighbour, key in neighbour_keys(tile, tiles[tile], improved, cost, tiles).items():
+            if key < pending.get(neighbour, np.inf):
+                pending[neighbour] = key
+                heapq.heappush(queue, (key, neighbour))
+
+    cost.flush()
+    allocation.flush()
+    return cost, allocation
+
+
+def open_tiled(friction_path, cost_path, allocation_path, cell_size):
+    tiled.update(friction=np.load(friction_path, mmap_mode='r'),
+                 cost=np.load(cost_path, mmap_mode='r'),
+                 allocation=np.load(allocation_path, mmap_mode='r'),
+                 cell_size=cell_size)
+
+
+def solve_tile_worker(bounds):
+    improved, tile_cost, tile_alloc = solve_tile(tiled['friction'], tiled['cost'], tiled['allocation'],
+                                                 bounds, tiled['cell_size'])
+    if not improved.any():
+        return improved, None, None
+    return improved, tile_cost, tile_alloc
+
+
+def accumulated_cost_parallel(friction, source_rows, source_cols, cell_size, workdir, tile_size=256, processes=None,
+                              ids=None):
+    # Multi-core variant of accumulated_cost_tiled. Every round solves all
+    # pending tiles in a process pool against the costs of the previous round
+    # and then exchanges the halos by writing all tiles back at once. Rounds
+    # repeat until no tile edge improves, which is the same fixed point as
+    # the single-threaded solve, so the cost is bit-for-bit identical.
+    friction_path = getattr(friction, 'filename', None)
+    if friction_path is None:
+        friction_path = os.path.join(workdir, 'friction.npy')
+        np.save(friction_path, friction)
+    cost, allocation, tiles, pending = init_tiled(friction.shape, source_rows, source_cols, workdir, tile_size, ids)
+
+    initargs = (friction_path, cost.filename, allocation.filename, cell_size)
+    with ProcessPoolExecutor(processes, initializer=open_tiled, initargs=initargs) as pool:
+        while pending:
+            cost.flush()
+            allocation.flush()
+            active = sorted(pending)
+            pending = {}
+            results = list(pool.map(solve_tile_worker, [tiles[tile] for tile in active]))
+            for tile, (improved, tile_cost, tile_alloc) in zip(active, results):
+                if tile_cost is None:
+                    continue
+                r0, r1, c0, c1 = tiles[tile]
+                cost[r0:r1, c0:c1] = tile_cost
+                allocation[r0:r1, c0:c1] = tile_alloc
+                for neighbour in neighbour_keys(tile, tiles[tile], improved, cost, tiles):
+                    pending[neighbour] = 0.0
+
+    cost.flush()
+    allocation.flush()
+    return cost, allocation
+
+
+def read_friction(raster_path):
+    import rasterio
+    with rasterio.open(raster_path) as raster:
+        data = raster.read(1, masked=True).astype(np.float64).filled(np.nan)
+        profile = raster.profile
+    return data, profile
+
+
+def read_facilities(facilities_path, profile):
+    # Facilities inside the raster and their pixels. The index is the fid in
+    # facilities_path, so it still matches the file when some are skipped.
+    import geopandas as gpd
+    from rasterio.transform import rowcol
+    facilities = gpd.read_file(facilities_path, fid_as_index=True).to_crs(profile['crs'])
+    rows, cols = rowcol(profile['transform'], facilities.geometry.x, facilities.geometry.y)
+    rows, cols = np.asarray(rows), np.asarray(cols)
+    inside = (rows >= 0) & (rows < profile['height']) & (cols >= 0) & (cols < profile['width'])
+    if not inside.all():
+        print(f"{(~inside).sum()} facilities outside the friction surface were skipped")
+    return facilities[inside], rows[inside], cols[inside]
+
+
+def friction_to_memmap(raster_path, memmap_path, tile_size=512):
+    import rasterio
+    from rasterio.windows import Window
+    with rasterio.open(raster_path) as raster:
+        profile = raster.profile
+        friction = np.lib.format.open_memmap(memmap_path, mode='w+', dtype=np.float32, shape=(raster.height, raster.width))
+        for r0, r1, c0, c1 in tile_bounds(friction.shape, tile_size).values():
+            window = Window(c0, r0, c1 - c0, r1 - r0)
+            friction[r0:r1, c0:c1] = raster.read(1, window=window, masked=True).astype(np.float32).filled(np.nan)
+    friction.flush()
+    return friction, profile
+
+
+def write_raster(raster_path, data, profile, dtype, nodata):
+    import rasterio
+    profile = profile.copy()
+    profile.update(dtype=dtype, count=1, nodata=nodata, compress='deflate')
+    with rasterio.open(raster_path, 'w', **profile) as raster:
+        raster.write(data.astype(dtype), 1)
+
+
+def facility_ids(facilities, id_field=None):
+    # Allocation ids of the facilities: their fid or an integer id_field
+    return np.asarray(facilities[id_field] if id_field else facilities.index, dtype=np.int32)
+
+
+def travel_time(friction_path, facilities_path, traveltime_path, allocation_path=None, id_field=None):
+    # Friction is in min/km on a metric grid (EPSG:3857), so the cell size is
+    # converted to km and the accumulated minutes are written out as hours.
+    # Allocation pixels hold the fid (or id_field) of the nearest facility.
+    friction, profile = read_friction(friction_path)
+    cell_size = abs(profile['transform'].a) / 1000
+    facilities, rows, cols = read_facilities(facilities_path, profile)
+
+    cost, allocation = accumulated_cost(friction, rows, cols, cell_size, facility_ids(facilities, id_field))
+
+    write_raster(traveltime_path, cost / 60, profile, 'float32', np.nan)
+    if allocation_path:
+        write_raster(allocation_path, allocation, profile, 'int32', -1)
+    return cost, allocation
+
+
+def write_raster_tiled(raster_path, data, profile, dtype, nodata, tile_size=512, scale=1):
+    import rasterio
+    from rasterio.windows import Window
+    profile = profile.copy()
+    # GeoTIFF tiles must be multiples of 16, the source may be striped
+    profile.update(dtype=dtype, count=1, nodata=nodata, compress='deflate', tiled=True, blockxsize=256, blockysize=256)
+    with rasterio.open(raster_path, 'w', **profile) as raster:
+        for r0, r1, c0, c1 in tile_bounds(data.shape, tile_size).values():
+            block = np.array(data[r0:r1, c0:c1])
+            if block.dtype.kind == 'f':
+                block = np.where(np.isfinite(block), block / scale, nodata)
+            raster.write(block.astype(dtype), 1, window=Window(c0, r0, c1 - c0, r1 - r0))
+
+
+def travel_time_tiled(friction_path, facilities_path, traveltime_path, allocation_path=None, workdir='.',
+                      tile_size=512, processes=1, id_field=None):
+    # Same as travel_time, but the friction surface, cost and allocation are
+    # kept in memory-mapped files under workdir. With more than one process
+    # the tiles are solved in parallel.
+    friction, profile = friction_to_memmap(friction_path, os.path.join(workdir, 'friction.npy'), tile_size)
+    cell_size = abs(profile['transform'].a) / 1000
+    facilities, rows, cols = read_facilities(facilities_path, profile)
+    ids = facility_ids(facilities, id_field)
+
+    if processes == 1:
+        cost, allocation = accumulated_cost_tiled(friction, rows, cols, cell_size, workdir, tile_size, ids)
+    else:
+        cost, allocation = accumulated_cost_parallel(friction, rows, cols, cell_size, workdir, tile_size, processes,
+                                                     ids)
+
+    write_raster_tiled(traveltime_path, cost, profile, 'float32', np.nan, tile_size, scale=60)
+    if allocation_path:
+        write_raster_tiled(allocation_path, allocation, profile, 'int32', -1, tile_size)
+    return cost, allocation
+
+
+if __name__ == "__main__":
+    friction_path = 'friction surface.tif'
+    facilities_path = 'facilities.gpkg'
+    traveltime_path = 'traveltime.tif'
+    allocation_path = 'allocation.tif'
+
+    travel_time(friction_path, facilities_path, traveltime_path, allocation_path)
@@ -0,0 +1,215 @@
+import math
+from qgis.PyQt.QtCore import QCoreApplication, QVariant
+from qgis.core import (QgsProcessing,
+                       QgsFeature,
+                       QgsFeatureSink,
+                       QgsField,
+                       QgsFields,
+                       QgsGeometry,
+                       QgsPointXY,
+                       QgsWkbTypes,
+                       QgsCoordinateTransform,
+                       QgsProcessingException,
+                       QgsProcessingAlgorithm,
+                       QgsProcessingParameterMultipleLayers,
+                       QgsProcessingParameterNumber,
+                       QgsProcessingParameterEnum,
+                       QgsProcessingParameterFeatureSink,
+                       NULL)
+
+
+class FacilityDedupAlgorithm(QgsProcessingAlgorithm):
+    INPUTS = 'INPUTS'
+    CELL_SIZE = 'CELL_SIZE'
+    MODE = 'MODE'
+    REPRESENTATIVE = 'REPRESENTATIVE'
+    OUTPUT = 'OUTPUT'
+
+    def tr(self, string):
+        return QCoreApplication.translate('Processing', string)
+
+    def createInstance(self):
+        return FacilityDedupAlgorithm()
+
+    def name(self):
+        return 'facilitydedup'
+
+    def displayName(self):
+        return self.tr('Deduplicate facilities')
+
+    def group(self):
+        return self.tr('Facilities')
+
+    def groupId(self):
+        return 'facilityscripts'
+
+    def shortHelpString(self):
+        return self.tr("Merges facility point layers and keeps one point per facility, replacing the grid, "
+                       "extract by location and centroids steps of facilities.model3.\n"
+                       "Layers are given in priority order: attributes are taken from the first layer that has a value. "
+                       "Grid cell mode keeps one point per cell of the given size, radius mode merges facilities "
+                       "closer than the given distance to a higher priority facility. In radius mode the cell centre "
+                       "is the position of the highest priority facility.")
+
+    def initAlgorithm(self, config=None):
+        self.addParameter(
+            QgsProcessingParameterMultipleLayers(
+                self.INPUTS,
+                self.tr('Facility layers (highest priority first)'),
+                QgsProcessing.TypeVectorPoint
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.MODE,
+                self.tr('Mode'),
+                options=['Grid cell', 'Radius'],
+                defaultValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterNumber(
+                self.CELL_SIZE,
+                self.tr('Cell size or radius (layer units)'),
+                type=QgsProcessingParameterNumber.Double,
+                defaultValue=1000,
+                minValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.REPRESENTATIVE,
+                self.tr('Output point'),
+                options=['Cell centre', 'Highest priority facility', 'Mean position'],
+                defaultValue=0
+            )
+        )
+        self.addParameter(
+            QgsProcessingParameterFeatureSink(
+                self.OUTPUT,
+                self.tr('Facilities')
+            )
+        )
+
+    @staticmethod
+    def grid_clusters(points, cell_size):
+        # One cluster per occupied cell, found with a dict keyed by cell
+        # instead of a grid layer and a spatial predicate. Returns the cluster
+        # of every point and the centre of every cluster's cell.
+        clusters = {}
+        labels = []
+        for x, y in points:
+            key = (math.floor(x / cell_size), math.floor(y / cell_size))
+            labels.append(clusters.setdefault(key, len(clusters)))
+        centres = [((i + 0.5) * cell_size, (j + 0.5) * cell_size) for i, j in clusters]
+        return labels, centres
+
+    @staticmethod
+    def radius_clusters(points, radius):
+        # Points in priority order join the nearest earlier anchor within
+        # radius or become an anchor themselves. Anchors are hashed by cells
+        # of size radius, so only the 3x3 neighbouring cells are searched and
+        # the whole pass stays linear.
+        cells = {}
+        anchors = []
+        labels = []
+        for x, y in points:
+            i, j = math.floor(x / radius), math.floor(y / radius)
+            best, best_distance = None, radius
+            for di in (-1, 0, 1):
+                for dj in (-1, 0, 1):
+                    for anchor in cells.get((i + di, j + dj), ()):
+                        distance = math.hypot(anchors[anchor][0] - x, anchors[anchor][1] - y)
+                        if distance <= best_distance:
+                            best, best_distance = anchor, distance
+            if best is None:
+                best = len(anchors)
+                anchors.append((x, y))
+                cells.setdefault((i, j), []).append(best)
+            labels.append(best)
+        return labels, anchors
+
+    def processAlgorithm(self, parameters, context, feedback):
+        layers = self.parameterAsLayerList(parameters, self.INPUTS, context)
+        mode = self.parameterAsEnum(parameters, self.MODE, context)
+        cell_size = self.parameterAsDouble(parameters, self.CELL_SIZE, context)
+        representative = self.parameterAsEnum(parameters, self.REPRESENTATIVE, context)
+
+        if not layers:
+            raise QgsProcessingException(self.tr('No facility layers given'))
+        if cell_size <= 0:
+            raise QgsProcessingException(self.tr('Cell size must be greater than 0'))
+
+        crs = layers[0].crs()
+
+        # Union of all fields by name, the first layer defines the type
+        fields = QgsFields()
+        for layer in layers:
+            for field in layer.fields():
+                if fields.indexOf(field.name()) == -1:
+                    fields.append(QgsField(field))
+        fields.append(QgsField('sources', QVariant.String))
+        fields.append(QgsField('facilities', QVariant.Int))
+
+        points = []
+        attributes = []
+        sources = []
+        for layer in layers:
+            transform = QgsCoordinateTransform(layer.crs(), crs, context.transformContext())
+            names = layer.fields().names()
+            for feature in layer.getFeatures():
+                if feedback.isCanceled():
+                    return {}
+                geometry = feature.geometry()
+                if geometry.isEmpty():
+                    continue
+                geometry.transform(transform)
+                point = geometry.centroid().asPoint() if geometry.isMultipart() else geometry.asPoint()
+                points.append((point.x(), point.y()))
+                attributes.append(dict(zip(names, feature.attributes())))
+                sources.append(layer.name())
+
+        feedback.pushInfo(f"Facilities: {len(points)}")
+
+        if mode == 0:
+            labels, centres = FacilityDedupAlgorithm.grid_clusters(points, cell_size)
+        else:
+            labels, centres = FacilityDedupAlgorithm.radius_clusters(points, cell_size)
+
+        # Members of every cluster, still in priority order
+        members = [[] for _ in centres]
+        for index, label in enumerate(labels):
+            members[label].append(index)
+
+        feedback.pushInfo(f"Unique facilities: {len(centres)}")
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context,
+                                               fields, QgsWkbTypes.Point, crs)
+
+        names = fields.names()
+        for label, indices in enumerate(members):
+            if feedback.isCanceled():
+                break
+            if representative == 0:
+                x, y = centres[label]
+            elif representative == 1:
+                x, y = points[indices[0]]
+            else:
+                x = sum(points[i][0] for i in indices) / len(indices)
+                y = sum(points[i][1] for i in indices) / len(indices)
+
+            merged = {}
+            for i in indices:
+                for name, value in attributes[i].items():
+                    if name not in merged and value is not None and value != NULL:
+                        merged[name] = value
+            merged['sources'] = ','.join(dict.fromkeys(sources[i] for i in indices))
+            merged['facilities'] = len(indices)
+
+            feat = QgsFeature(fields)
+            feat.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(x, y)))
+            feat.setAttributes([merged.get(name, NULL) for name in names])
+            sink.addFeature(feat, QgsFeatureSink.FastInsert)
+            feedback.setProgress(int((label + 1) / len(members) * 100))
+
+        return {self.OUTPUT: dest_id}
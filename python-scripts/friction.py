@@ -0,0 +1,104 @@
+import numpy as np
+
+# Movement speed in min/km per friction layer, as burned in roads.model3 and
+# region.model3
+SPEEDS = {'unpaved': 6, 'paved': 1, 'borders': 120}
+
+# Merge order of friction.model3, later layers overwrite earlier ones
+LAYER_ORDER = ['unpaved', 'paved', 'borders']
+
+# OSM surface values counted as paved, see "Extract by expression (paved)"
+PAVED_SURFACES = ['asfalto_pavimentado', 'asphalt', 'cobblestone', 'cobblestone:flattened', 'compacted',
+                  'concrete', 'concrete:plates', 'fine_gravel', 'grass_paver', 'gravel', 'paved',
+                  'paving_stones', 'paving_stones:30', 'pebblestone', 'sett', 'unpaved;paved', 'metal',
+                  'Elevada_em_comcreto', 'gate']
+
+
+def region_grid(region, resolution):
+    # Grid covering the region, snapped to the resolution like the GDAL
+    # rasterize steps with georeferenced units
+    from rasterio.transform import from_origin
+    minx, miny, maxx, maxy = region.total_bounds
+    width = int(np.ceil((maxx - minx) / resolution))
+    height = int(np.ceil((maxy - miny) / resolution))
+    return from_origin(minx, maxy, resolution, resolution), (height, width)
+
+
+def road_layers(roads, surface_field='surface'):
+    paved = roads[surface_field].isin(PAVED_SURFACES)
+    return {'paved': roads.geometry[paved], 'unpaved': roads.geometry[~paved]}
+
+
+def land_cover_friction(land_cover_path, land_cover_speeds, transform, shape, crs):
+    # Land cover classes mapped to min/km on the friction grid, classes
+    # without a speed stay NaN
+    import rasterio
+    from rasterio.warp import reproject, Resampling
+    classes = np.zeros(shape, dtype=np.int32)
+    with rasterio.open(land_cover_path) as raster:
+        reproject(rasterio.band(raster, 1), classes, dst_transform=transform, dst_crs=crs,
+                  resampling=Resampling.nearest)
+    lookup = np.full(max(max(land_cover_speeds), classes.max()) + 1, np.nan, dtype=np.float32)
+    lookup[list(land_cover_speeds)] = list(land_cover_speeds.values())
+    return lookup[np.clip(classes, 0, None)]
+
+
+def burn_friction(layers, transform, shape, speeds=SPEEDS, base=None, mask=None):
+    # Burns every layer with its speed in one rasterize call. Shapes are
+    # burned in LAYER_ORDER so later layers overwrite earlier ones, just like
+    # the gdal:merge in friction.model3. Pixels without any layer keep the
+    # base friction (e.g. land cover) or NaN, pixels outside mask are NaN.
+    from rasterio.features import rasterize
+    shapes = [(geometry, speeds[name]) for name in LAYER_ORDER if name in layers
+              for geometry in layers[name] if geometry is not None and not geometry.is_empty]
+    friction = rasterize(shapes, out_shape=shape, transform=transform, fill=np.nan, dtype='float32')
+    if base is not None:
+        friction = np.where(np.isnan(friction), base, friction)
+    if mask is not None:
+        friction[~mask] = np.nan
+    return friction
+
+
+def build_friction(roads_path, borders_path, region_path, resolution, crs='EPSG:3857',
+                   land_cover_path=None, land_cover_speeds=None, speeds=SPEEDS, output_path=None):
+    # roads.model3 + friction.model3 in memory: rasterize all road classes
+    # and borders, merge with land cover and clip to the region. Writes at
+    # most one GeoTIFF and returns the array for the cost engine.
+    import geopandas as gpd
+    from rasterio.features import geometry_mask
+
+    region = gpd.read_file(region_path).to_crs(crs)
+    roads = gpd.read_file(roads_path, mask=region).to_crs(crs)
+    borders = gpd.read_file(borders_path, mask=region).to_crs(crs)
+
+    transform, shape = region_grid(region, resolution)
+    layers = dict(road_layers(roads), borders=borders.geometry)
+    base = None
+    if land_cover_path:
+        base = land_cover_friction(land_cover_path, land_cover_speeds, transform, shape, crs)
+    mask = geometry_mask(region.geometry, out_shape=shape, transform=transform, invert=True)
+    friction = burn_friction(layers, transform, shape, speeds, base, mask)
+
+    profile = {'driver': 'GTiff', 'height': shape[0], 'width': shape[1], 'count': 1,
+               'dtype': 'float32', 'crs': crs, 'transform': transform, 'nodata': np.nan}
+    if output_path:
+        from costdistance import write_raster
+        write_raster(output_path, friction, profile, 'float32', np.nan)
+    return friction, profile
+
+
+if __name__ == "__main__":
+    roads_path = 'roads.gpkg'
+    borders_path = 'borders.gpkg'
+    region_path = 'region.gpkg'
+    facilities_path = 'facilities.gpkg'
+    traveltime_path = 'traveltime.tif'
+    resolution = 1000
+
+    from costdistance import accumulated_cost, facility_ids, read_facilities, write_raster
+
+    # Hand the friction surface straight to the cost engine
+    friction, profile = build_friction(roads_path, borders_path, region_path, resolution)
+    facilities, rows, cols = read_facilities(facilities_path, profile)
+    cost, allocation = accumulated_cost(friction, rows, cols, resolution / 1000, facility_ids(facilities))
+    write_raster(traveltime_path, cost / 60, profile, 'float32', np.nan)
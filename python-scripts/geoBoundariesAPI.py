@@ -7,15 +7,16 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterFeatureSink,
                        QgsProcessingParameterString,
                        QgsProcessingParameterEnum,
+                       QgsProcessingParameterBoolean,
                        QgsFeature,
                        QgsField,
+                       QgsFields,
                        QgsGeometry,
-                       QgsVectorLayer,
-                       QgsProject,
+                       QgsWkbTypes,
+                       QgsCoordinateReferenceSystem,
                        QgsProcessingContext)
 from qgis import processing
-import requests
-import geopandas as gpd
+from geoboundaries import BoundaryCache, fetch_many, make_session, stream_geoboundary
 
 class FetchGeoBoundaryAlgorithm(QgsProcessingAlgorithm):
     INPUT = 'INPUT'
@@ -23,6 +24,12 @@ class FetchGeoBoundaryAlgorithm(QgsProcessingAlgorithm):
     RELEASE_TYPE = 'RELEASE_TYPE'
     COUNTRY_CODE = 'COUNTRY_CODE'
     BOUNDARY_TYPE = 'BOUNDARY_TYPE'
+    STREAM = 'STREAM'
+
+    # Attributes of every boundary and the API metadata of its download
+    SHAPE_FIELDS = ['shapeName', 'shapeISO', 'shapeID', 'shapeGroup', 'shapeType']
+    METADATA_FIELDS = ['boundaryID', 'boundaryName', 'boundaryType', 'boundaryYearRepresented',
+                       'boundarySource', 'boundaryLicense', 'buildDate']
 
     def tr(self, string):
         return QCoreApplication.translate('Processing', string)
@@ -49,7 +56,7 @@ class FetchGeoBoundaryAlgorithm(QgsProcessingAlgorithm):
         self.addParameter(
             QgsProcessingParameterString(
                 self.COUNTRY_CODE,
-                self.tr('Country Code ISO-3'),
+                self.tr('Country Codes ISO-3 (comma separated)'),
                 defaultValue='DEU'
             )
         )
@@ -58,7 +65,8 @@ class FetchGeoBoundaryAlgorithm(QgsProcessingAlgorithm):
                 self.BOUNDARY_TYPE,
                 self.tr('Boundary Type'),
                 options=['ADM0','ADM1','ADM2','ADM3','ADM4','ADM5'],
-                defaultValue=0
+                allowMultiple=True,
+                defaultValue=[0]
             )
         )
         self.addParameter(
@@ -69,6 +77,13 @@ class FetchGeoBoundaryAlgorithm(QgsProcessingAlgorithm):
                 defaultValue='gbOpen'
             )
         )
+        self.addParameter(
+            QgsProcessingParameterBoolean(
+                self.STREAM,
+                self.tr('Stream large downloads in batches (low memory)'),
+                defaultValue=False
+            )
+        )
         self.addParameter(
             QgsProcessingParameterFeatureSink(
                 self.OUTPUT,
@@ -82,105 +97,123 @@ class FetchGeoBoundaryAlgorithm(QgsProcessingAlgorithm):
         release_types = ['gbOpen', 'gbHumanitarian', 'gbAuthorative']
         release_type = release_types[release_type_index]
         
-        country_code = self.parameterAsString(parameters, self.COUNTRY_CODE, context)
+        country_codes = self.parameterAsString(parameters, self.COUNTRY_CODE, context)
+        country_codes = [code.strip().upper() for code in country_codes.split(',') if code.strip()]
         
-        boundary_type_index = self.parameterAsEnum(parameters, self.BOUNDARY_TYPE, context)
+        boundary_type_indices = self.parameterAsEnums(parameters, self.BOUNDARY_TYPE, context)
         boundary_types = ['ADM0','ADM1','ADM2','ADM3','ADM4','ADM5']
-        boundary_type = boundary_types[boundary_type_index]
+        boundary_types = [boundary_types[index] for index in boundary_type_indices]
+
+        fields = QgsFields()
+        for name in self.SHAPE_FIELDS + self.METADATA_FIELDS:
+            fields.append(QgsField(name, QVariant.String))
+
+        if self.parameterAsBool(parameters, self.STREAM, context):
+            return self.stream_geoboundary(parameters, context, feedback, fields,
+                                           release_type, country_codes, boundary_types)
 
-        results = self.fetch_geoboundary(release_type, country_code, boundary_type, feedback)
+        results = self.fetch_geoboundary(release_type, country_codes, boundary_types, feedback)
 
         if not results:
             raise QgsProcessingException('Failed to fetch geoBoundary')
-        
+
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields,
+                                               QgsWkbTypes.MultiPolygon, QgsCoordinateReferenceSystem('EPSG:4326'))
+
         total_features = sum(len(result['gdf']) for result in results)
         processed_features = 0
-        
-        layer_name = f"{country_code}_{boundary_type}_{release_type}_geoBoundaries"
-        vector_layer = QgsVectorLayer("Polygon?crs=epsg:4326", layer_name, "memory")
-        pr = vector_layer.dataProvider()
-        
-        for result in results:
-            gdf = result['gdf']
-            metadata = result['metadata']
-
-            if gdf.empty:
-                feedback.reportError("Loaded GeoDataFrame is empty.")
-                continue
-
-            for index, row in gdf.iterrows():
-                if feedback.isCanceled():
-                    break
-
-                # Debugging type and attribute
-                if not hasattr(row['geometry'], 'wkt'):
-                    feedback.reportError(f"Unexpected type for geometry: {type(row['geometry'])}. Expected shapely geometry object.")
-                    continue  # Skip this iteration if the geometry type is unexpected
-
-                # Assuming row['geometry'] is a shapely.geometry object as expected
-                feat = QgsFeature()
-                try:
-                    feat.setGeometry(QgsGeometry.fromWkt(row['geometry'].wkt))
-                except Exception as e:
-                    feedback.reportError(f"Error setting geometry from WKT: {e}")
-                    continue  # Skip this iteration if there was an error setting the geometry
-
-                # Add additional feature settings and add feature to the provider as necessary
-                pr.addFeature(feat)
-
-        vector_layer.updateExtents()
-        
-        QgsProject.instance().addMapLayer(vector_layer)
 
-        feedback.pushInfo("GeoBoundary layer added to the project.")
-        
-        return {self.OUTPUT: vector_layer.id()}
-
-    def fetch_geoboundary(self, release_type, country_code, boundary_type, feedback):
-        api_url = f"https://www.geoboundaries.org/api/current/{release_type}/{country_code}/{boundary_type}/"
-        try:
-            response = requests.get(api_url)
-            if response.status_code != 200:
-                print(f"Failed to fetch data: HTTP Status Code {response.status_code}")
-                return None
-
-            data = response.json()
-            results = []
-            
-            if not isinstance(data, list):
-                data = [data]
-                
-            total_countries = len(data)
-            processed_countries = 0
-            
-            for country_data in data:
-                
-                if feedback.isCanceled():
-                    return None
-                
-                if 'gjDownloadURL' not in country_data:
-                    feedback.reportError("'gjDownloadURL' not found in the response for" + country_data.get('boundaryISO', 'an unknown country'))
-                    continue
-
-                geojson_url = country_data['gjDownloadURL']
-                gdf = gpd.read_file(geojson_url)
-                if gdf.empty:
-                    feedback.reportError("Loaded GeoDataFrame is empty.")
-                    continue
-                    
-                metadata = {key: country_data.get(key, '') for key in country_data}
-                
-                results.append({'gdf': gdf, 'metadata' : metadata})
-                
-                processed_countries += 1
-                feedback.setProgress(int((processed_countries / total_countries) * 100))
-                
-
-            return results
-            
-        except requests.RequestException as e:
-            feedback.reportError(f"Request error: {e}")
-        except Exception as e:
-            feedback.reportError(f"An unexpected error occurred: {e}")
-
-        return None
\ No newline at end of file
+        for result in results:
+            if feedback.isCanceled():
+                break
+
+            gdf = result['gdf']
+            metadata = result['metadata']
+
+            if gdf.empty:
+                feedback.reportError("Loaded GeoDataFrame is empty.")
+                continue
+
+            features = self.features_from_gdf(gdf, metadata, fields)
+            sink.addFeatures(features, QgsFeatureSink.FastInsert)
+
+            processed_features += len(gdf)
+            feedback.setProgress(int(processed_features / total_features * 100))
+
+        feedback.pushInfo(f"{processed_features} boundaries written.")
+
+        return {self.OUTPUT: dest_id}
+
+    def stream_geoboundary(self, parameters, context, feedback, fields, release_type, country_codes, boundary_types):
+        # One country and level after the other, each parsed in batches from
+        # the download (or the cache) and written to the sink batch by
+        # batch, so memory stays at one batch however large the file is
+        (sink, dest_id) = self.parameterAsSink(parameters, self.OUTPUT, context, fields,
+                                               QgsWkbTypes.MultiPolygon, QgsCoordinateReferenceSystem('EPSG:4326'))
+        keys = [(country_code, boundary_type) for country_code in country_codes for boundary_type in boundary_types]
+        processed_features = 0
+        with make_session() as session:
+            for index, (country_code, boundary_type) in enumerate(keys):
+                try:
+                    for metadata, gdf in stream_geoboundary(session, release_type, country_code, boundary_type,
+                                                            cache=BoundaryCache()):
+                        if feedback.isCanceled():
+                            return {self.OUTPUT: dest_id}
+                        sink.addFeatures(self.features_from_gdf(gdf, metadata, fields), QgsFeatureSink.FastInsert)
+                        processed_features += len(gdf)
+                except Exception as e:
+                    feedback.reportError(f"Failed to fetch {country_code} {boundary_type}: {e}")
+                feedback.setProgress(int((index + 1) / len(keys) * 100))
+
+        if not processed_features:
+            raise QgsProcessingException('Failed to fetch geoBoundary')
+
+        feedback.pushInfo(f"{processed_features} boundaries written.")
+
+        return {self.OUTPUT: dest_id}
+
+    def features_from_gdf(self, gdf, metadata, fields):
+        # The whole geometry column goes to WKB in one vectorized call and
+        # QGIS parses the WKB directly, no WKT round trip per row
+        wkbs = gdf.geometry.to_wkb()
+        columns = [name for name in self.SHAPE_FIELDS if name in gdf.columns]
+        values = gdf[columns].astype(object).where(gdf[columns].notna(), None).to_numpy()
+        metadata_values = [str(metadata.get(name, '')) for name in self.METADATA_FIELDS]
+        positions = [self.SHAPE_FIELDS.index(name) for name in columns]
+
+        features = []
+        for wkb, row in zip(wkbs, values):
+            if wkb is None:
+                continue
+            geometry = QgsGeometry()
+            geometry.fromWkb(wkb)
+            geometry.convertToMultiType()
+            attributes = [None] * len(self.SHAPE_FIELDS)
+            for position, value in zip(positions, row):
+                attributes[position] = value if value is None else str(value)
+            feat = QgsFeature(fields)
+            feat.setGeometry(geometry)
+            feat.setAttributes(attributes + metadata_values)
+            features.append(feat)
+        return features
+
+    def fetch_geoboundary(self, release_type, country_codes, boundary_types, feedback):
+        # All countries and levels are downloaded concurrently over one
+        # pooled session with retries and cached on disk, see
+        # geoboundaries.fetch_many
+        total = len(country_codes) * len(boundary_types)
+        done = []
+
+        def progress(key, result, error):
+            done.append(key)
+            if error is not None:
+                feedback.reportError(f"Failed to fetch {key[0]} {key[1]}: {error}")
+            elif not result:
+                feedback.reportError(f"No boundaries found for {key[0]} {key[1]}")
+            feedback.setProgress(int(len(done) / total * 100))
+
+        results, errors = fetch_many(country_codes, boundary_types, release_type, callback=progress,
+                                     cache=BoundaryCache())
+        # Keep the requested order
+        return [result for key in sorted(results, key=lambda key: (country_codes.index(key[0]), boundary_types.index(key[1])))
+                for result in results[key]]
@@ -0,0 +1,309 @@
+import codecs
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import geopandas as gpd
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+API_URL = 'https://www.geoboundaries.org/api/current'
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'geoboundaries')
+
+
+class BoundaryCache:
+    # API responses and parsed boundaries on disk. Responses are kept per
+    # release type, ISO code and ADM level with their ETag/Last-Modified and
+    # are used without any request for max_age seconds, then revalidated
+    # with a conditional request. Boundaries are stored as GeoPackage under
+    # a hash of the build metadata (boundaryID, buildDate, source date and
+    # download URL), so a new build is a new file and an unchanged one is
+    # never downloaded again. Files are evicted least recently used first
+    # once the cache is larger than max_bytes.
+
+    def __init__(self, directory=CACHE_DIR, max_bytes=2 * 1024 ** 3, max_age=7 * 24 * 3600):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, name):
+        return os.path.join(self.directory, name)
+
+    def write(self, name, write):
+        # Write to a temporary file first so readers never see half a file
+        root, ext = os.path.splitext(name)
+        tmp = self.path(f'{root}.{threading.get_ident()}.tmp{ext}')
+        write(tmp)
+        os.replace(tmp, self.path(name))
+        self.evict()
+
+    def load_metadata(self, release_type, country_code, boundary_type):
+        name = f'{release_type}_{country_code}_{boundary_type}.json'
+        try:
+            with open(self.path(name)) as file:
+                entry = json.load(file)
+        except (OSError, ValueError):
+            return None
+        os.utime(self.path(name))
+        return entry
+
+    def store_metadata(self, release_type, country_code, boundary_type, data, etag, last_modified):
+        entry = {'data': data, 'fetched': time.time(), 'etag': etag, 'last_modified': last_modified}
+
+        def write(path):
+            with open(path, 'w') as file:
+                json.dump(entry, file)
+        self.write(f'{release_type}_{country_code}_{boundary_type}.json', write)
+        return entry
+
+    @staticmethod
+    def geometry_key(release_type, country_code, boundary_type, country_data):
+        build = [release_type, country_code, boundary_type] + [
+            str(country_data.get(key, '')) for key in ('boundaryID', 'buildDate', 'sourceDataUpdateDate', 'gjDownloadURL')]
+        return hashlib.sha1('|'.join(build).encode()).hexdigest()
+
+    def load_geometry(self, key):
+        path = self.geometry_path(key)
+        if not os.path.exists(path):
+            return None
+        os.utime(path)
+        return gpd.read_file(path)
+
+    def geometry_path(self, key):
+        return self.path(f'{key}.gpkg')
+
+    def geometry_writer(self, key):
+        # Temporary GeoPackage that batches are appended to while streaming,
+        # commit() moves it into the cache
+        tmp = self.path(f'{key}.{threading.get_ident()}.tmp.gpkg')
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+        def append(gdf):
+            gdf.to_file(tmp, driver='GPKG', mode='a' if os.path.exists(tmp) else 'w')
+
+        def commit():
+            if os.path.exists(tmp):
+                os.replace(tmp, self.geometry_path(key))
+                self.evict()
+        return append, commit
+
+    def store_geometry(self, key, gdf):
+        self.write(f'{key}.gpkg', lambda path: gdf.to_file(path, driver='GPKG'))
+
+    def evict(self):
+        with self.lock:
+            files = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and '.tmp.' not in entry.name:
+                    stat = entry.stat()
+                    files.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                    total -= size
+                except OSError:
+                    pass
+
+
+def make_session(pool_size=8, retries=3, backoff=0.5):
+    # One session for all requests, so connections are kept alive and
+    # reused. Failed connections, 429 and 5xx responses are retried with
+    # exponential backoff (backoff, 2 * backoff, 4 * backoff, ... seconds).
+    retry = Retry(total=retries, backoff_factor=backoff, status_forcelist=(429, 500, 502, 503, 504),
+                  allowed_methods=('GET',), raise_on_status=False)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def fetch_metadata(session, release_type, country_code, boundary_type, api_url=API_URL, timeout=60,
+                   cache=None, offline=False):
+    url = f"{api_url}/{release_type}/{country_code}/{boundary_type}/"
+    entry = cache.load_metadata(release_type, country_code, boundary_type) if cache is not None else None
+    if entry is not None and (offline or time.time() - entry['fetched'] < cache.max_age):
+        return entry['data']
+    if offline:
+        raise LookupError(f"{country_code} {boundary_type} is not cached")
+
+    headers = {}
+    if entry is not None:
+        if entry['etag']:
+            headers['If-None-Match'] = entry['etag']
+        if entry['last_modified']:
+            headers['If-Modified-Since'] = entry['last_modified']
+    response = session.get(url, headers=headers, timeout=timeout)
+    if response.status_code == 304 and entry is not None:
+        data = entry['data']
+        etag = response.headers.get('ETag', entry['etag'])
+        last_modified = response.headers.get('Last-Modified', entry['last_modified'])
+    else:
+        response.raise_for_status()
+        data = response.json()
+        etag, last_modified = response.headers.get('ETag'), response.headers.get('Last-Modified')
+    if cache is not None:
+        cache.store_metadata(release_type, country_code, boundary_type, data, etag, last_modified)
+    return data
+
+
+def fetch_geoboundary(session, release_type, country_code, boundary_type, api_url=API_URL, timeout=60,
+                      cache=None, offline=False):
+    # [{'gdf': ..., 'metadata': ...}] for one country and level, like the
+    # old fetch_geoboundary but downloading the GeoJSON through the session
+    # instead of gpd.read_file(url). Raises on errors.
+    data = fetch_metadata(session, release_type, country_code, boundary_type, api_url, timeout, cache, offline)
+    if not isinstance(data, list):
+        data = [data]
+
+    results = []
+    for country_data in data:
+        if 'gjDownloadURL' not in country_data:
+            raise KeyError(f"'gjDownloadURL' not found for {country_data.get('boundaryISO', country_code)}")
+        key = BoundaryCache.geometry_key(release_type, country_code, boundary_type, country_data)
+        gdf = cache.load_geometry(key) if cache is not None else None
+        if gdf is None:
+            if offline:
+                raise LookupError(f"{country_code} {boundary_type} is not cached")
+            download = session.get(country_data['gjDownloadURL'], timeout=timeout)
+            download.raise_for_status()
+            gdf = gpd.read_file(io.BytesIO(download.content))
+            if cache is not None:
+                cache.store_geometry(key, gdf)
+        metadata = {key: country_data.get(key, '') for key in country_data}
+        results.append({'gdf': gdf, 'metadata': metadata})
+    return results
+
+
+def fetch_many(country_codes, boundary_types, release_type='gbOpen', max_workers=8, retries=3, backoff=0.5,
+               api_url=API_URL, timeout=60, callback=None, cache=None, offline=False):
+    # Every country and level at once, at most max_workers downloads in
+    # flight over one pooled session. Returns {(country, level): results}
+    # and {(country, level): error} for the ones that failed after retries.
+    # callback(key, results, error) is called as each download finishes.
+    # With a BoundaryCache repeat runs read from disk, offline=True never
+    # touches the network.
+    keys = [(country_code, boundary_type) for country_code in country_codes for boundary_type in boundary_types]
+    results, errors = {}, {}
+    with make_session(max_workers, retries, backoff) as session, ThreadPoolExecutor(max_workers) as pool:
+        futures = {pool.submit(fetch_geoboundary, session, release_type, *key, api_url, timeout, cache, offline): key for key in keys}
+        for future in as_completed(futures):
+            key = futures[future]
+            try:
+                results[key] = future.result()
+            except Exception as e:
+                errors[key] = e
+            if callback is not None:
+                callback(key, results.get(key), errors.get(key))
+    return results, errors
+
+
+def iter_features(stream, batch_size=1000, chunk_size=1 << 16):
+    # Features of a GeoJSON FeatureCollection read incrementally from a
+    # binary stream, in lists of batch_size. Only the current batch and the
+    # unparsed rest of the last chunk are held in memory. A feature larger
+    # than the buffer doubles the read size, so big single geometries are
+    # not re-parsed once per chunk.
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder('utf-8')()
+    start = re.compile(r'"features"\s*:\s*\[')
+    buffer, position, eof = '', 0, False
+
+    def read(size):
+        nonlocal buffer, eof
+        chunk = stream.read(size)
+        eof = not chunk
+        buffer += text.decode(chunk or b'', final=eof)
+
+    while True:
+        match = start.search(buffer)
+        if match:
+            position = match.end()
+            break
+        if eof:
+            return
+        # Keep a tail in case the key is split between chunks
+        buffer = buffer[-32:]
+        read(chunk_size)
+
+    batch = []
+    size = chunk_size
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+        if position < len(buffer) and buffer[position] == ']':
+            break
+        try:
+            if position == len(buffer):
+                raise ValueError
+            feature, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise ValueError('Truncated GeoJSON feature collection')
+            buffer, position = buffer[position:], 0
+            read(size)
+            size *= 2
+            continue
+        batch.append(feature)
+        position, size = end, chunk_size
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+            buffer, position = buffer[position:], 0
+    if batch:
+        yield batch
+
+
+def stream_geoboundary(session, release_type, country_code, boundary_type, batch_size=1000, api_url=API_URL,
+                       timeout=60, cache=None, offline=False):
+    # Like fetch_geoboundary but yields (metadata, GeoDataFrame) batches of
+    # batch_size boundaries, parsed from the HTTP stream or read from the
+    # cached GeoPackage, so memory stays at one batch for any file size.
+    # Downloads are appended to the cache batch by batch.
+    data = fetch_metadata(session, release_type, country_code, boundary_type, api_url, timeout, cache, offline)
+    if not isinstance(data, list):
+        data = [data]
+
+    for country_data in data:
+        if 'gjDownloadURL' not in country_data:
+            raise KeyError(f"'gjDownloadURL' not found for {country_data.get('boundaryISO', country_code)}")
+        metadata = {key: country_data.get(key, '') for key in country_data}
+        key = BoundaryCache.geometry_key(release_type, country_code, boundary_type, country_data)
+
+        if cache is not None and os.path.exists(cache.geometry_path(key)):
+            path = cache.geometry_path(key)
+            os.utime(path)
+            offset = 0
+            while True:
+                gdf = gpd.read_file(path, rows=slice(offset, offset + batch_size))
+                if gdf.empty:
+                    break
+                yield metadata, gdf
+                offset += batch_size
+            continue
+        if offline:
+            raise LookupError(f"{country_code} {boundary_type} is not cached")
+
+        append, commit = cache.geometry_writer(key) if cache is not None else (None, None)
+        with session.get(country_data['gjDownloadURL'], timeout=timeout, stream=True) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            for features in iter_features(response.raw, batch_size):
+                gdf = gpd.GeoDataFrame.from_features(features, crs='EPSG:4326')
+                if append is not None:
+                    append(gdf)
+                yield metadata, gdf
+        if commit is not None:
+            commit()
@@ -0,0 +1,75 @@
+import numpy as np
+
+
+def bin_labels(values, edges):
+    # Bin index of every value like np.digitize(values, edges) - 1, with -1
+    # for values outside [edges[0], edges[-1])
+    labels = np.searchsorted(edges, values, side='right') - 1
+    labels[(labels >= len(edges) - 1) | np.isnan(values)] = -1
+    return labels
+
+
+def dense_labels(labels):
+    # Arbitrary group ids (e.g. zone ids read from a second raster) to
+    # 0..n-1, returns the dense labels and the id of each group
+    ids, dense = np.unique(labels, return_inverse=True)
+    return dense.reshape(np.shape(labels)), ids
+
+
+def grouped_reduce(groups, values, ngroups, stats=('max', 'min', 'mean', 'count'), quantiles=()):
+    # Per group statistics of values in one pass instead of one full scan
+    # per group. count/sum/mean come from bincount, min/max from a scatter,
+    # and median and quantiles from a single sort by (group, value), which
+    # then also gives min/max. Groups below 0 and NaN
+    # values are ignored; empty groups are NaN (count 0).
+    groups = np.asarray(groups).ravel()
+    values = np.asarray(values).ravel()
+    keep = (groups >= 0) & (groups < ngroups) & ~np.isnan(values)
+    groups, values = groups[keep], values[keep]
+
+    result = {}
+    count = np.bincount(groups, minlength=ngroups)
+    empty = count == 0
+    if 'count' in stats:
+        result['count'] = count
+    if 'sum' in stats or 'mean' in stats:
+        total = np.bincount(groups, weights=values, minlength=ngroups)
+        if 'sum' in stats:
+            result['sum'] = total
+        if 'mean' in stats:
+            with np.errstate(invalid='ignore'):
+                result['mean'] = total / count
+
+    if 'median' not in stats and not len(quantiles):
+        # Without quantiles a scatter (ufunc.at) is cheaper than a sort
+        for stat, ufunc, fill in (('min', np.minimum, np.inf), ('max', np.maximum, -np.inf)):
+            if stat in stats:
+                reduced = np.full(ngroups, fill)
+                ufunc.at(reduced, groups, values)
+                result[stat] = np.where(empty, np.nan, reduced)
+    else:
+        order = np.lexsort((values, groups))
+        ordered = values[order]
+        start = np.concatenate([[0], np.cumsum(count)[:-1]])
+        last = start + np.maximum(count - 1, 0)
+
+        def pick(q):
+            # Linear interpolation inside each group's sorted run
+            position = start + q * np.maximum(count - 1, 0)
+            low = np.floor(position).astype(np.int64)
+            high = np.minimum(low + 1, last)
+            if not ordered.size:
+                return np.full(ngroups, np.nan)
+            low, high = np.minimum(low, ordered.size - 1), np.minimum(high, ordered.size - 1)
+            picked = ordered[low] + (ordered[high] - ordered[low]) * (position - low)
+            return np.where(empty, np.nan, picked)
+
+        if 'min' in stats:
+            result['min'] = pick(0.0)
+        if 'max' in stats:
+            result['max'] = pick(1.0)
+        if 'median' in stats:
+            result['median'] = pick(0.5)
+        for q in quantiles:
+            result[f'q{q:g}'] = pick(q)
+    return result
@@ -0,0 +1,125 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+
+from rasteralign import aligned_weights, read_weights
+from rasterreader import block_windows, read_block
+from zonalstats import ZoneSums
+
+
+class HexGrid:
+    # The hexagon grid of native:creategrid (type 4, no overlay): flat topped
+    # hexagons of height spacing, columns 0.75 hexagon widths apart, odd
+    # columns half a hexagon lower, starting at the top left corner of the
+    # extent. Ids run column by column from 1 like the grid layer, 0 means
+    # outside the grid.
+
+    def __init__(self, extent, spacing):
+        self.xmin, self.ymin, self.xmax, self.ymax = extent
+        self.spacing = spacing
+        self.radius = spacing / np.sqrt(3)
+        self.cols = int(np.ceil((self.xmax - self.xmin) / (1.5 * self.radius)))
+        self.rows = int(np.ceil((self.ymax - self.ymin) / spacing))
+
+    def key(self):
+        return repr((self.xmin, self.ymin, self.xmax, self.ymax, self.spacing)).encode()
+
+    @property
+    def size(self):
+        return self.cols * self.rows
+
+    def locate(self, x, y):
+        # Hexagon id of each point in O(1): axial coordinates relative to the
+        # first hexagon's centre, rounded in cube coordinates
+        dx = (np.asarray(x, dtype=np.float64) - self.xmin - self.radius) / self.radius
+        dy = (self.ymax - self.spacing / 2 - np.asarray(y, dtype=np.float64)) / self.radius
+        q = 2 / 3 * dx
+        r = -dx / 3 + dy / np.sqrt(3)
+        s = -q - r
+        rq, rr, rs = np.round(q), np.round(r), np.round(s)
+        dq, dr, ds = np.abs(rq - q), np.abs(rr - r), np.abs(rs - s)
+        fix_q = (dq > dr) & (dq > ds)
+        fix_r = ~fix_q & (dr > ds)
+        rq = np.where(fix_q, -rr - rs, rq)
+        rr = np.where(fix_r, -rq - rs, rr)
+        col = rq.astype(np.int64)
+        row = rr.astype(np.int64) + (col - (col & 1)) // 2
+        inside = (col >= 0) & (col < self.cols) & (row >= 0) & (row < self.rows)
+        return np.where(inside, col * self.rows + row + 1, 0)
+
+    def polygons(self):
+        # (id, polygon) of every hexagon, the same cells as the grid layer
+        from shapely.geometry import Polygon
+        offsets = [(-1, 0), (-0.5, 1), (0.5, 1), (1, 0), (0.5, -1), (-0.5, -1)]
+        for col in range(self.cols):
+            cx = self.xmin + self.radius * (1 + 1.5 * col)
+            for row in range(self.rows):
+                cy = self.ymax - self.spacing * (row + 0.5 + 0.5 * (col % 2))
+                yield col * self.rows + row + 1, Polygon(
+                    [(cx + ox * self.radius, cy + oy * self.spacing / 2) for ox, oy in offsets])
+
+
+def pixel_index(grid, profile, cache_dir):
+    # Hexagon id of every pixel centre, computed once per grid and raster
+    # transform and kept on disk as an int32 .npy
+    digest = hashlib.sha1(grid.key())
+    digest.update(repr((tuple(profile['transform']), profile['height'], profile['width'])).encode())
+    path = os.path.join(cache_dir, f'hex-{digest.hexdigest()[:16]}.npy')
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        transform = profile['transform']
+        index = np.lib.format.open_memmap(path + '.tmp.npy', mode='w+', dtype=np.int32,
+                                          shape=(profile['height'], profile['width']))
+        cols = np.arange(profile['width']) + 0.5
+        for r in range(profile['height']):
+            x, y = transform * (cols, np.full(cols.shape, r + 0.5))
+            index[r] = grid.locate(x, y)
+        index.flush()
+        del index
+        os.replace(path + '.tmp.npy', path)
+    return np.load(path, mmap_mode='r')
+
+
+def aggregate(grid, index, raster_path, weights_path=None, block_size=1024):
+    # Count, mean and population weighted mean of a raster per hexagon, a
+    # bincount per block instead of a zonal statistics run per hexagon
+    sums = ZoneSums(grid.size)
+    with rasterio.open(raster_path) as raster, aligned_weights(raster, weights_path) as weights_raster:
+        for window in block_windows(raster.width, raster.height, block_size):
+            values, valid = read_block(raster, window, np.float64)
+            weights = read_weights(weights_raster, window, valid)
+            rows, cols = window.toslices()
+            sums.update(index[rows, cols][valid], values[valid], weights)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        table = pd.DataFrame({'id': np.arange(1, grid.size + 1), 'count': sums.count[1:],
+                              'mean': sums.sum[1:] / sums.count[1:]})
+        if weights_path:
+            table['population'] = sums.weight[1:]
+            table['pop_mean'] = sums.weighted_sum[1:] / sums.weight[1:]
+    return table
+
+
+if __name__ == "__main__":
+    import geopandas as gpd
+
+    traveltime_path = 'traveltime.tif'
+    population_path = 'ghsl.tif'
+    communities_path = 'indigenous communities.gpkg'
+    cache_dir = 'hex_index'
+    save_path = 'hexagons_traveltime.csv'
+
+    # 10 km hexagons over the travel time extent, as in Analysis.model3
+    with rasterio.open(traveltime_path) as raster:
+        profile = raster.profile
+        grid = HexGrid(tuple(raster.bounds), 10000)
+    index = pixel_index(grid, profile, cache_dir)
+    table = aggregate(grid, index, traveltime_path, population_path)
+
+    # Hexagons with indigenous communities, instead of extractbylocation
+    communities = gpd.read_file(communities_path).to_crs(profile['crs'])
+    hexagons = np.unique(grid.locate(communities.geometry.x, communities.geometry.y))
+    table = table[table['id'].isin(hexagons[hexagons > 0])]
+    table.to_csv(save_path, index=False)
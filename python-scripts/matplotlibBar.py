@@ -16,6 +16,9 @@ from qgis import processing
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+import numpy as np
+
+from attributes import read_columns
 
 class matplotlibBar(QgsProcessingAlgorithm):
 
@@ -234,34 +237,32 @@ class matplotlibBar(QgsProcessingAlgorithm):
         sorting_option = self.parameterAsEnum(
             parameters, self.SORTING_OPTION, context)
 
-        categories, values, color_values = [], [], []
-
-        for feature in source.getFeatures():
-            cat_value = feature[cat_attribute_name]
-            val_value = feature[val_attribute_name]
-
-            if cat_value is not None and val_value is not None:
-                categories.append(str(cat_value))
-                values.append(float(val_value))
+        names = [cat_attribute_name, val_attribute_name] + ([color_attribute_name] if color_attribute_name else [])
+        columns = read_columns(source, names, {color_attribute_name: object, cat_attribute_name: object,
+                                               val_attribute_name: np.float64}, feedback=feedback)
+        cat_array, cat_mask = columns[cat_attribute_name]
+        val_array, val_mask = columns[val_attribute_name]
+        valid = ~cat_mask & ~val_mask
 
-            if color_attribute_name:
-                color_value = feature[color_attribute_name] if feature[color_attribute_name] is not None else "Default"
-                color_values.append(color_value)
+        categories = [str(value) for value in cat_array[valid]]
+        values = val_array[valid]
 
         if sorting_option == 1:
-            sorted_indices = sorted(
-                range(len(values)), key=lambda i: values[i])
+            sorted_indices = np.argsort(values, kind='stable')
         elif sorting_option == 2:
-            sorted_indices = sorted(
-                range(len(values)), key=lambda i: values[i], reverse=True)
+            sorted_indices = np.argsort(-values, kind='stable')
         else:
-            sorted_indices = range(len(values))
+            sorted_indices = np.arange(len(values))
 
         sorted_categories = [categories[i] for i in sorted_indices]
-        sorted_values = [values[i] for i in sorted_indices]
+        sorted_values = values[sorted_indices]
 
+        color_values = []
         if color_attribute_name:
-            color_values = [color_values[i] for i in sorted_indices]
+            color_array, color_mask = columns[color_attribute_name]
+            color_array = color_array.copy()
+            color_array[color_mask] = "Default"
+            color_values = list(color_array[valid][sorted_indices])
 
         plt.figure(figsize=(fig_width, fig_height))
 
@@ -284,11 +285,7 @@ class matplotlibBar(QgsProcessingAlgorithm):
         else:
             plt.bar(sorted_categories, sorted_values, color=color, alpha=alpha)
 
-        if color_attribute_name and len(color_values) != len(categories):
-            raise QgsProcessingException(
-                self.tr('Mismatch in the number of categories and color values.'))
-
-        if not categories or not values:
+        if not categories:
             raise QgsProcessingException(
                 self.tr("No valid data found. Please check the selected attributes."))
 
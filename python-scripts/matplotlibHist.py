@@ -15,6 +15,9 @@ from qgis import processing
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
+import numpy as np
+
+from attributes import read_columns
 
 class matplotlibHist(QgsProcessingAlgorithm):
 
@@ -73,9 +76,6 @@ class matplotlibHist(QgsProcessingAlgorithm):
         
         attribute_name = self.parameterAsString(parameters, self.ATTRIBUTE, context)
         
-        attribute_values = []
-        
-        max_value = self.parameterAsDouble(parameters, self.MAX_VALUE, context) if parameters[self.MAX_VALUE] is not None else max(attribute_values)
         plot_output_path = self.parameterAsFileOutput(parameters, 'PLOT_OUTPUT', context)
         fig_width = self.parameterAsDouble(parameters, self.FIG_WIDTH, context)
         fig_height = self.parameterAsDouble(parameters, self.FIG_HEIGHT, context)
@@ -87,17 +87,17 @@ class matplotlibHist(QgsProcessingAlgorithm):
         x_label = self.parameterAsString(parameters, self.X_LABEL, context)
         y_label = self.parameterAsString(parameters, self.Y_LABEL, context)
             
-        for feature in source.getFeatures():
-            attribute_value = feature[attribute_name]
-            if attribute_value is not None:
-                attribute_values.append(attribute_value)
+        values, mask = read_columns(source, [attribute_name], {attribute_name: np.float64}, feedback=feedback)[attribute_name]
+        attribute_values = values[~mask]
 
-        if not attribute_values:
+        if not attribute_values.size:
             raise QgsProcessingException(self.tr("No attribute values found. Please check the selected attribute."))
+
+        max_value = self.parameterAsDouble(parameters, self.MAX_VALUE, context) if parameters[self.MAX_VALUE] is not None else attribute_values.max()
         
         try:
             plt.figure(figsize=(fig_width,fig_height))
-            plt.hist(attribute_values, bins=bins,alpha=alpha, color=color, range=(min(attribute_values), max_value))
+            plt.hist(attribute_values, bins=bins,alpha=alpha, color=color, range=(attribute_values.min(), max_value))
             plt.title(plot_title if plot_title else 'Value Distribution by Category')
             plt.xlabel(x_label if x_label else ' ')
             plt.ylabel(y_label if y_label else 'Frequence')
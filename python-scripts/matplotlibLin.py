@@ -1,3 +1,4 @@
+import csv
 import math
 import matplotlib.pyplot as plt
 from qgis.PyQt.QtCore import QCoreApplication
@@ -8,10 +9,12 @@ from qgis.core import (QgsProcessing,
                        QgsProcessingParameterField,
                        QgsProcessingParameterString,
                        QgsProcessingParameterNumber,
-                       QgsProcessingParameterBoolean)
+                       QgsProcessingParameterBoolean,
+                       QgsProcessingParameterEnum)
 
 import numpy as np
 from scipy.optimize import curve_fit
+from attributes import read_columns
 import matplotlib
 matplotlib.use('Agg')
 
@@ -20,6 +23,8 @@ class matplotlibExp(QgsProcessingAlgorithm):
 
     INPUT = 'INPUT'
     OUTPUT = 'OUTPUT'
+    FIT_TABLE = 'FIT_TABLE'
+    MODELS = 'MODELS'
     X_VALUES = 'X_VALUES'
     Y_VALUES = 'Y_VALUES'
     X_MAX = 'X_MAX'
@@ -30,6 +35,11 @@ class matplotlibExp(QgsProcessingAlgorithm):
     X_LABEL = 'X_LABEL'
     Y_LABEL = 'Y_LABEL'
 
+    # Model name to the static method it is fitted with
+    FIT_MODELS = {'Exponential': 'exponential_decay_no_offset',
+                  'Power': 'power_law',
+                  'Logistic': 'logistic'}
+
     def tr(self, string):
         return QCoreApplication.translate('Processing', string)
 
@@ -106,6 +116,24 @@ class matplotlibExp(QgsProcessingAlgorithm):
             )
         )
         
+        self.addParameter(
+            QgsProcessingParameterEnum(
+                self.MODELS,
+                self.tr('Models'),
+                options=list(self.FIT_MODELS),
+                allowMultiple=True,
+                defaultValue=[0]
+            )
+        )
+
+        self.addParameter(QgsProcessingParameterFileDestination(
+            self.FIT_TABLE,
+            self.tr('Fit Table'),
+            'CSV Files (*.csv)',
+            optional=True
+        )
+        )
+
         self.addParameter(
             QgsProcessingParameterNumber(
                 self.B,
@@ -155,6 +183,59 @@ class matplotlibExp(QgsProcessingAlgorithm):
     def exponential_decay_no_offset(x,a,b):
         return a * np.exp(b * x)
 
+    @staticmethod
+    def power_law(x, a, b):
+        return a * np.power(x, b)
+
+    @staticmethod
+    def logistic(x, l, k, x0):
+        return l / (1 + np.exp(-k * (x - x0)))
+
+    @staticmethod
+    def max_per_x(x_values, y_values):
+        # Group y by x and keep the maximum, sorted by x
+        order = np.argsort(x_values, kind='stable')
+        x_sorted = x_values[order]
+        y_sorted = y_values[order]
+        starts = np.flatnonzero(np.r_[True, x_sorted[1:] != x_sorted[:-1]])
+        return x_sorted[starts], np.maximum.reduceat(y_sorted, starts)
+
+    @staticmethod
+    def initial_guesses(x, y):
+        # Closed-form starting points from straight-line fits of the
+        # linearized models (y > 0 is required by the caller)
+        guesses = {}
+        b, log_a = np.polyfit(x, np.log(y), 1)
+        guesses['Exponential'] = [np.exp(log_a), b]
+        positive = x > 0
+        if positive.sum() > 1:
+            b, log_a = np.polyfit(np.log(x[positive]), np.log(y[positive]), 1)
+            guesses['Power'] = [np.exp(log_a), b]
+        l = y.max() * 1.05
+        k, intercept = np.polyfit(x, np.log(y / (l - y)), 1)
+        guesses['Logistic'] = [l, k, -intercept / k if k else np.median(x)]
+        return guesses
+
+    @staticmethod
+    def fit_model(name, x, y, initial_guess):
+        # x and y must be the same sample for every model that is ranked,
+        # AIC values of different samples are not comparable
+        model = getattr(matplotlibExp, matplotlibExp.FIT_MODELS[name])
+        try:
+            popt, pcov = curve_fit(model, x, y, p0=initial_guess, maxfev=10000)
+        except (RuntimeError, ValueError) as e:
+            return {'model': name, 'error': str(e)}
+        residuals = y - model(x, *popt)
+        rss = float(np.sum(residuals ** 2))
+        n, k = len(y), len(popt)
+        return {'model': name,
+                'n': n,
+                'params': popt,
+                'initial_guess': initial_guess,
+                'rmse': math.sqrt(rss / n),
+                'r2': 1 - rss / float(np.sum((y - y.mean()) ** 2)),
+                'aic': n * math.log(rss / n) + 2 * k if rss > 0 else -math.inf}
+
     def processAlgorithm(self, parameters, context, feedback):
 
         source = self.parameterAsSource(parameters, self.INPUT, context)
@@ -162,7 +243,9 @@ class matplotlibExp(QgsProcessingAlgorithm):
         y_field = self.parameterAsString(parameters, self.Y_VALUES, context)
         x_max = self.parameterAsDouble(parameters, self.X_MAX, context)
         y_max = self.parameterAsDouble(parameters, self.Y_MAX, context)
-        b = self.parameterAsDouble(parameters, self.B, context)
+        b = self.parameterAsDouble(parameters, self.B, context) if parameters.get(self.B) is not None else None
+        models = [list(self.FIT_MODELS)[i] for i in self.parameterAsEnums(parameters, self.MODELS, context)]
+        fit_table = self.parameterAsFileOutput(parameters, self.FIT_TABLE, context)
         color = self.parameterAsString(parameters, self.COLOR, context)
         title = self.parameterAsString(parameters, self.TITLE, context)
         x_label = self.parameterAsString(parameters, self.X_LABEL, context)
@@ -179,68 +262,76 @@ class matplotlibExp(QgsProcessingAlgorithm):
         feedback.pushInfo(f"y_label: {y_label}")
         feedback.pushInfo(f"output: {output}")
 
-        x_values = []
-        y_values = []
-
-        for feature in source.getFeatures():
-            try:
-                x = float(feature[x_field])
-                y = float(feature[y_field])
-                if not (math.isnan(x) or math.isnan(y)):
-                    x_values.append(x)
-                    y_values.append(y)
-            except Exception as e:
-                continue
+        columns = read_columns(source, [x_field, y_field], {x_field: np.float64, y_field: np.float64},
+                               feedback=feedback)
+        (x_array, x_mask), (y_array, y_mask) = columns[x_field], columns[y_field]
+        valid = ~x_mask & ~y_mask
+        x_values = x_array[valid]
+        y_values = y_array[valid]
 
-        feedback.pushInfo(f"x_values: {x_values}")
-        feedback.pushInfo(f"y_values: {y_values}")
+        feedback.pushInfo(f"Features: {len(x_values)}")
 
-        grouped_data = {}
-
-        for x, y in zip(x_values, y_values):
-            if x not in grouped_data:
-                grouped_data[x] = [y]
-            else:
-                grouped_data[x].append(y)
-
-        max_y_values = {x: max(y_list) for x, y_list in grouped_data.items()}
+        if not x_values.size:
+            feedback.reportError("No numeric values in x and y field")
+            return {}
 
-        x_values_np = np.array(sorted(max_y_values.keys()))
-        y_values_np = np.array([max_y_values[x] for x in x_values_np])
+        x_values_np, y_values_np = matplotlibExp.max_per_x(x_values, y_values)
         
         positive_filter = y_values_np > 0
         
         x_values_positive = x_values_np[positive_filter]
         y_values_positive = y_values_np[positive_filter]
         
-        if np.any(y_values_positive.min() <= 0):
-            feedback.reportError("Negative values in y field")
+        # The power law needs x > 0. All models are fitted and ranked on the
+        # same points, so with the power law selected x <= 0 is dropped for all.
+        if 'Power' in models:
+            dropped = int(np.sum(x_values_positive <= 0))
+            if dropped:
+                feedback.pushInfo(f"{dropped} points with x <= 0 are left out of all fits for the power law")
+            x_values_positive, y_values_positive = x_values_positive[x_values_positive > 0], y_values_positive[x_values_positive > 0]
+
+        if y_values_positive.size < 3:
+            feedback.reportError("Not enough positive values in y field")
             return {}
         
-        initial_guess = [np.max(y_values_positive), b] # Assuming a starts at the max values, b is negative, c is zero
-        
-        try:
-            popt, pcov = curve_fit(
-                matplotlibExp.exponential_decay_no_offset, 
-                x_values_positive, 
-                y_values_positive,
-                p0=initial_guess,
-            )
-            a_fit, b_fit = popt
-            x_axis = np.linspace(x_values_positive.min(), x_values_positive.max(),500)
-            y_fit = matplotlibExp.exponential_decay_no_offset(x_axis, a_fit, b_fit)
+        guesses = matplotlibExp.initial_guesses(x_values_positive, y_values_positive)
+        if b is not None:
+            guesses['Exponential'] = [np.max(y_values_positive), b]
+        models = [name for name in models if name in guesses]
+
+        fits = [matplotlibExp.fit_model(name, x_values_positive, y_values_positive, guesses[name]) for name in models]
+
+        for fit in fits:
+            if 'error' in fit:
+                feedback.reportError(f"Error during curve fitting ({fit['model']}): {fit['error']}")
+        fits = sorted((fit for fit in fits if 'error' not in fit), key=lambda fit: fit['aic'])
+        if not fits:
+            return {}
 
-            feedback.pushInfo(f"Inital guess: {initial_guess}")
-            feedback.pushInfo(f"Fit parameters: {popt}")
+        for rank, fit in enumerate(fits, 1):
+            feedback.pushInfo(f"{rank}. {fit['model']}: parameters {fit['params']}, initial guess {fit['initial_guess']}, "
+                              f"RMSE {fit['rmse']:.4g}, R2 {fit['r2']:.4f}, AIC {fit['aic']:.2f}")
 
+        if fit_table:
+            with open(fit_table, 'w', newline='') as table:
+                writer = csv.writer(table)
+                writer.writerow(['rank', 'model', 'n', 'parameters', 'rmse', 'r2', 'aic'])
+                for rank, fit in enumerate(fits, 1):
+                    writer.writerow([rank, fit['model'], fit['n'], ' '.join(f'{p:.6g}' for p in fit['params']),
+                                     fit['rmse'], fit['r2'], fit['aic']])
 
-        except RuntimeError as e:
-            feedback.reportError(f"Error during curve fitting: {e}")
-            return{}
+        x_axis = np.linspace(x_values_positive.min(), x_values_positive.max(),500)
         
         try:
             plt.scatter(x_values_positive, y_values_positive)
-            plt.plot(x_axis, y_fit, color=color, label='Fit Line')
+            for rank, fit in enumerate(fits):
+                # The power law is only defined (and fitted) for x > 0
+                x_fit = x_axis[x_axis > 0] if fit['model'] == 'Power' else x_axis
+                y_fit = getattr(matplotlibExp, matplotlibExp.FIT_MODELS[fit['model']])(x_fit, *fit['params'])
+                if rank == 0:
+                    plt.plot(x_fit, y_fit, color=color, label='Fit Line' if len(fits) == 1 else fit['model'])
+                else:
+                    plt.plot(x_fit, y_fit, linestyle='--', label=fit['model'])
             plt.xlim(x_values_positive.min(), x_max if x_max is not None else x_values_positive.max())
             plt.ylim(y_values_positive.min(), y_max if y_max is not None else y_values_positive.max())
             plt.title(title)
@@ -250,7 +341,7 @@ class matplotlibExp(QgsProcessingAlgorithm):
             plt.savefig(output)
             plt.close()
             feedback.pushInfo(f"Scatter plot saved to {output}")
-            return {self.OUTPUT: output}
+            return {self.OUTPUT: output, self.FIT_TABLE: fit_table}
         except Exception as e:
             feedback.reportError(f"Error: {e}")
             return {}
@@ -11,7 +11,9 @@ from qgis.core import (QgsProcessing,
 import matplotlib
 matplotlib.use('Agg')
 import matplotlib.pyplot as plt
-import math
+import numpy as np
+
+from attributes import read_columns
 
 class matplotlibScat(QgsProcessingAlgorithm):
     
@@ -180,21 +182,14 @@ class matplotlibScat(QgsProcessingAlgorithm):
         feedback.pushInfo(f"y_label: {y_label}")
         feedback.pushInfo(f"output: {output}")
 
-        x_values = []
-        y_values = []
-
-        for feature in source.getFeatures():
-            try:
-                x = float(feature[x_field])
-                y = float(feature[y_field])
-                if not (math.isnan(x) or math.isnan(y)):
-                    x_values.append(x)
-                    y_values.append(y)
-            except Exception as e:
-                continue
-
-        feedback.pushInfo(f"x_values: {x_values}")
-        feedback.pushInfo(f"y_values: {y_values}")
+        columns = read_columns(source, [x_field, y_field], {x_field: np.float64, y_field: np.float64},
+                               feedback=feedback)
+        (x_array, x_mask), (y_array, y_mask) = columns[x_field], columns[y_field]
+        valid = ~x_mask & ~y_mask
+        x_values = x_array[valid]
+        y_values = y_array[valid]
+
+        feedback.pushInfo(f"Features: {len(x_values)}")
         
         try:
             plt.scatter(x_values, y_values, color=color)
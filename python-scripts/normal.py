@@ -1,29 +1,20 @@
-import rasterio
 import numpy as np
 import matplotlib.pyplot as plt
 from scipy.stats import norm
-
-def read_raster_data(raster_path):
-    with rasterio.open(raster_path) as raster:
-        data = raster.read(1, masked=True)
-        if raster.nodata is not None:
-            data = data.filled(np.nan)
-    return data
-
-def flatten_data(data):
-    return data.flatten()
+from rasterstats import histogram_raster, summarize_raster
 
 # Replace 'traveltime.tif' with the path to your actual raster file
-x_axis = flatten_data(read_raster_data('traveltime.tif'))
-
-# Filter out NaN values
-x_axis = x_axis[~np.isnan(x_axis)]
+# One windowed pass collects the moments and a quantile sketch, a second
+# one counts the histogram bins, whose range depends on mean and sd
+summary = summarize_raster('traveltime.tif')
 
-mean = np.mean(x_axis)
-sd = np.std(x_axis)
+mean = summary.moments.mean
+sd = summary.moments.std
 
 # Plot histogram
-plt.hist(x_axis, bins=50, density=True, alpha=0.6, color='g', range=(mean-3*sd, mean+3*sd))
+edges = np.linspace(mean-3*sd, mean+3*sd, 51)
+counts = histogram_raster('traveltime.tif', edges).counts
+plt.hist(edges[:-1], bins=edges, weights=counts, density=True, alpha=0.6, color='g')
 xmin, xmax = plt.xlim()
 plt.xlim(0,5)
 plt.xlabel("Travel time in [h]")
@@ -32,7 +23,7 @@ x = np.linspace(xmin, xmax, 100)
 
 
 # Calculate and plot the 0.85 quantile
-quantile_90 = np.quantile(x_axis, 0.90)
+quantile_90 = summary.quantile(0.90)
 plt.axvline(x=quantile_90, color='r', linestyle='--', label='90%')
 plt.legend()
 
@@ -0,0 +1,94 @@
+from contextlib import contextmanager
+
+import numpy as np
+import rasterio
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import Resampling, transform_bounds
+from rasterio.windows import Window, from_bounds
+
+from rasterreader import block_windows, read_block
+from rasterstats import Comoments
+
+
+def same_grid(raster1, raster2):
+    return (raster1.crs == raster2.crs and raster1.transform == raster2.transform
+            and raster1.shape == raster2.shape)
+
+
+def overlap_window(raster1, raster2):
+    # Window of raster1 covered by raster2, worked out from both transforms
+    # and CRS instead of assuming a common upper left corner
+    left, bottom, right, top = transform_bounds(raster2.crs, raster1.crs, *raster2.bounds)
+    window = from_bounds(left, bottom, right, top, raster1.transform)
+    window = window.round_offsets().round_lengths()
+    return window.intersection(Window(0, 0, raster1.width, raster1.height))
+
+
+def aligned(raster, other, resampling=Resampling.nearest):
+    # other as a dataset on the grid of raster, a WarpedVRT unless the
+    # grids already match
+    if same_grid(raster, other):
+        return other
+    return WarpedVRT(other, crs=raster.crs, transform=raster.transform,
+                     width=raster.width, height=raster.height, resampling=resampling)
+
+
+@contextmanager
+def aligned_weights(raster, weights_path):
+    # Population counts of weights_path as a dataset on the grid of raster,
+    # None without weights_path. Counts are resampled with Resampling.sum,
+    # which is area weighted (GDAL 3.8+): a coarser pixel is split over the
+    # finer pixels it covers and finer pixels are added up, so totals are
+    # kept instead of counting a coarse pixel once per fine pixel.
+    if not weights_path:
+        yield None
+        return
+    with rasterio.open(weights_path) as weights_file:
+        weights_raster = aligned(raster, weights_file, Resampling.sum)
+        try:
+            yield weights_raster
+        finally:
+            if weights_raster is not weights_file:
+                weights_raster.close()
+
+
+def read_weights(weights_raster, window, valid):
+    # Weights of the valid pixels of a block, 0 where the weights are nodata
+    if weights_raster is None:
+        return None
+    weights, weights_valid = read_block(weights_raster, window, np.float64)
+    return np.where(weights_valid, weights, 0)[valid]
+
+
+def paired_blocks(raster_path1, raster_path2, block_size=1024, resampling=Resampling.nearest):
+    # Yields (window, values1, values2, valid) on the grid of raster1 over the
+    # overlap of both rasters. raster2 is read directly when the grids match
+    # and through a WarpedVRT on raster1's grid otherwise, so only the
+    # overlap is read and nothing is resampled to disk.
+    with rasterio.open(raster_path1) as raster1, rasterio.open(raster_path2) as raster2:
+        window = overlap_window(raster1, raster2)
+        aligned2 = aligned(raster1, raster2, resampling)
+        try:
+            for block in block_windows(raster1.width, raster1.height, block_size, window):
+                values1, valid1 = read_block(raster1, block)
+                values2, valid2 = read_block(aligned2, block)
+                yield block, values1, values2, valid1 & valid2
+        finally:
+            if aligned2 is not raster2:
+                aligned2.close()
+
+
+def correlate_rasters(raster_path1, raster_path2, block_size=1024, keep_values=True):
+    # Pearson correlation of two rasters in one streaming pass. The paired
+    # valid values are only collected when needed for plotting.
+    comoments = Comoments()
+    parts1, parts2 = [], []
+    for _, values1, values2, valid in paired_blocks(raster_path1, raster_path2, block_size):
+        filtered1, filtered2 = values1[valid], values2[valid]
+        comoments.update(filtered1, filtered2)
+        if keep_values:
+            parts1.append(filtered1)
+            parts2.append(filtered2)
+    if not keep_values:
+        return comoments.correlation, None, None
+    return comoments.correlation, np.concatenate(parts1), np.concatenate(parts2)
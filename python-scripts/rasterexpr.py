@@ -0,0 +1,189 @@
+import operator
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import rasterio
+from rasterio.features import geometry_mask
+from rasterio.vrt import WarpedVRT
+from rasterio.warp import Resampling, calculate_default_transform
+from rasterio.windows import Window, from_bounds, transform as window_transform
+
+
+class Raster:
+    # Lazy raster: a grid plus a function that computes any window of it.
+    # Clip, reproject, arithmetic and masks only build new nodes, nothing is
+    # read until write() evaluates the graph block by block. closers close
+    # the dataset handles of the source files the node reads from.
+
+    def __init__(self, crs, transform, shape, compute, closers=()):
+        self.crs = crs
+        self.transform = transform
+        self.shape = shape
+        self.compute = compute
+        self.closers = tuple(closers)
+
+    def block(self, window):
+        return self.compute(window)
+
+    def close(self):
+        for close in self.closers:
+            close()
+
+    def _combine(self, other, op):
+        if isinstance(other, Raster):
+            if other.shape != self.shape or other.transform != self.transform:
+                raise ValueError('Rasters are not on the same grid')
+            return Raster(self.crs, self.transform, self.shape,
+                          lambda window: op(self.block(window), other.block(window)),
+                          dict.fromkeys(self.closers + other.closers))
+        return Raster(self.crs, self.transform, self.shape, lambda window: op(self.block(window), other),
+                      self.closers)
+
+    def __add__(self, other):
+        return self._combine(other, operator.add)
+
+    def __sub__(self, other):
+        return self._combine(other, operator.sub)
+
+    def __mul__(self, other):
+        return self._combine(other, operator.mul)
+
+    def __truediv__(self, other):
+        return self._combine(other, operator.truediv)
+
+    def __lt__(self, other):
+        return self._combine(other, operator.lt)
+
+    def __le__(self, other):
+        return self._combine(other, operator.le)
+
+    def __gt__(self, other):
+        return self._combine(other, operator.gt)
+
+    def __ge__(self, other):
+        return self._combine(other, operator.ge)
+
+    def __rsub__(self, other):
+        return self._combine(other, lambda values, other: other - values)
+
+    def __rtruediv__(self, other):
+        return self._combine(other, lambda values, other: other / values)
+
+    __radd__ = __add__
+    __rmul__ = __mul__
+
+    def mask(self, condition):
+        # Keep pixels where condition holds, NaN elsewhere
+        return self._combine(condition, lambda values, keep: np.where(keep, values, np.nan))
+
+    def clip(self, geometries):
+        # Crop to the bounds of the geometries and mask everything outside
+        # them, like gdal:cliprasterbymasklayer with crop to cutline
+        geometries = list(geometries)
+        bounds = np.array([geometry.bounds for geometry in geometries])
+        crop = from_bounds(bounds[:, 0].min(), bounds[:, 1].min(), bounds[:, 2].max(), bounds[:, 3].max(),
+                           self.transform).round_offsets().round_lengths()
+        crop = crop.intersection(Window(0, 0, self.shape[1], self.shape[0]))
+        transform = window_transform(crop, self.transform)
+
+        def compute(window):
+            shifted = Window(window.col_off + crop.col_off, window.row_off + crop.row_off, window.width, window.height)
+            inside = geometry_mask(geometries, out_shape=(int(window.height), int(window.width)),
+                                   transform=window_transform(window, transform), invert=True)
+            return np.where(inside, self.block(shifted), np.nan)
+
+        return Raster(self.crs, transform, (int(crop.height), int(crop.width)), compute, self.closers)
+
+    def write(self, path, dtype='float32', nodata=np.nan, block_size=512, threads=4):
+        # One pass: blocks are computed on a thread pool (GDAL reads and NumPy
+        # release the GIL) and written in order from this thread. At most
+        # 2 * threads blocks are in flight, so a slow writer does not pile up
+        # finished blocks. Source datasets are closed afterwards.
+        profile = {'driver': 'GTiff', 'height': self.shape[0], 'width': self.shape[1], 'count': 1,
+                   'dtype': dtype, 'crs': self.crs, 'transform': self.transform, 'nodata': nodata,
+                   'tiled': True, 'blockxsize': block_size, 'blockysize': block_size, 'compress': 'deflate'}
+        windows = [Window(c, r, min(block_size, self.shape[1] - c), min(block_size, self.shape[0] - r))
+                   for r in range(0, self.shape[0], block_size) for c in range(0, self.shape[1], block_size)]
+        try:
+            with rasterio.open(path, 'w', **profile) as dst, ThreadPoolExecutor(threads) as pool:
+                pending = deque()
+                for window in windows:
+                    pending.append((window, pool.submit(self.block, window)))
+                    if len(pending) >= 2 * threads:
+                        self._write_block(dst, *pending.popleft(), dtype, nodata)
+                while pending:
+                    self._write_block(dst, *pending.popleft(), dtype, nodata)
+        finally:
+            self.close()
+
+    @staticmethod
+    def _write_block(dst, window, future, dtype, nodata):
+        data = future.result()
+        if not np.isnan(nodata):
+            data = np.where(np.isnan(data), nodata, data)
+        dst.write(np.asarray(data).astype(dtype), 1, window=window)
+
+
+def source(path, band=1, crs=None, resolution=None, resampling=Resampling.nearest):
+    # Raster file as a lazy node. With crs the file is read through a
+    # WarpedVRT, so reprojection happens on the fly per block. Every thread
+    # opens its own dataset handle, the node's close() closes them all.
+    handles = {}
+    lock = threading.Lock()
+    with rasterio.open(path) as raster:
+        grid_crs, grid_transform, shape = raster.crs, raster.transform, raster.shape
+        if crs is not None:
+            resolution = (resolution, resolution) if resolution else None
+            grid_transform, width, height = calculate_default_transform(
+                raster.crs, crs, raster.width, raster.height, *raster.bounds, resolution=resolution)
+            grid_crs, shape = rasterio.crs.CRS.from_user_input(crs), (height, width)
+
+    def dataset():
+        thread = threading.get_ident()
+        if thread not in handles:
+            raster = rasterio.open(path)
+            opened = [raster]
+            if crs is not None:
+                opened.append(WarpedVRT(raster, crs=grid_crs, transform=grid_transform,
+                                        width=shape[1], height=shape[0], resampling=resampling))
+            with lock:
+                handles[thread] = opened
+        return handles[thread][-1]
+
+    def close():
+        with lock:
+            for opened in handles.values():
+                for dataset in reversed(opened):
+                    dataset.close()
+            handles.clear()
+
+    def compute(window):
+        data = dataset().read(band, window=window, masked=True)
+        return data.astype(np.float64).filled(np.nan)
+
+    return Raster(grid_crs, grid_transform, shape, compute, [close])
+
+
+def from_array(array, crs, transform):
+    # In-memory array (e.g. the cost engine output) as a lazy node
+    def compute(window):
+        rows, cols = window.toslices()
+        return np.asarray(array[rows, cols], dtype=np.float64)
+
+    return Raster(crs, transform, array.shape, compute)
+
+
+if __name__ == "__main__":
+    import geopandas as gpd
+
+    ghsl_path = 'ghsl.tif'
+    study_area_path = 'study_area.gpkg'
+    save_path = 'ghsl_normalized.tif'
+
+    # ghsl.model3 after the merge: reproject to 1 km, clip to the study area
+    # and normalize, evaluated in one read and one write
+    study_area = gpd.read_file(study_area_path).to_crs('EPSG:3857')
+    ghsl = source(ghsl_path, crs='EPSG:3857', resolution=1000)
+    ((ghsl.clip(study_area.geometry) - 0) / 9875).write(save_path)
@@ -0,0 +1,51 @@
+import numpy as np
+import rasterio
+from rasterio.windows import Window
+
+
+def block_windows(width, height, block_size=1024, window=None):
+    # Square windows covering the raster (or a window of it), row by row
+    if window is None:
+        window = Window(0, 0, width, height)
+    col_off, row_off = int(window.col_off), int(window.row_off)
+    for r in range(row_off, row_off + int(window.height), block_size):
+        for c in range(col_off, col_off + int(window.width), block_size):
+            yield Window(c, r, min(block_size, col_off + int(window.width) - c),
+                         min(block_size, row_off + int(window.height) - r))
+
+
+def read_block(raster, window=None, dtype=np.float32, band=1):
+    # Values in the requested dtype plus a boolean mask of valid pixels
+    # (not nodata and finite). The values are not filled or copied.
+    data = raster.read(band, window=window, masked=True, out_dtype=dtype)
+    values = data.data
+    valid = ~np.ma.getmaskarray(data)
+    if values.dtype.kind == 'f':
+        valid &= np.isfinite(values)
+    return values, valid
+
+
+def read_raster_data(raster_path, window=None, dtype=np.float32, band=1):
+    with rasterio.open(raster_path) as raster:
+        if window is not None:
+            window = window.intersection(Window(0, 0, raster.width, raster.height))
+        return read_block(raster, window, dtype, band)
+
+
+def iter_blocks(raster_path, block_size=1024, window=None, dtype=np.float32, band=1):
+    # Streams (window, values, valid) blocks, memory stays at one block
+    with rasterio.open(raster_path) as raster:
+        for block in block_windows(raster.width, raster.height, block_size, window):
+            values, valid = read_block(raster, block, dtype, band)
+            yield block, values, valid
+
+
+def valid_values(raster_path, block_size=1024, window=None, dtype=np.float32, band=1):
+    # Only the valid pixels as one flat array, read block by block
+    parts = [values[valid] for _, values, valid in iter_blocks(raster_path, block_size, window, dtype, band)]
+    return np.concatenate(parts) if parts else np.empty(0, dtype=dtype)
+
+
+def flatten_data(data):
+    # View instead of copy for contiguous arrays
+    return data.ravel()
@@ -0,0 +1,238 @@
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from rasterreader import block_windows, iter_blocks
+
+
+class Moments:
+    # Count, mean and sum of squared deviations, merged with Chan's formula
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def update(self, values):
+        other = Moments()
+        other.count = values.size
+        if other.count:
+            other.mean = float(np.mean(values, dtype=np.float64))
+            other.m2 = float(np.sum((values - other.mean) ** 2, dtype=np.float64))
+        self.merge(other)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count:
+            delta = other.mean - self.mean
+            self.mean += delta * other.count / count
+            self.m2 += other.m2 + delta ** 2 * self.count * other.count / count
+            self.count = count
+
+    @property
+    def std(self):
+        return np.sqrt(self.m2 / self.count) if self.count else np.nan
+
+
+class Comoments:
+    # Paired moments for a streaming Pearson correlation, mergeable like
+    # Moments
+
+    def __init__(self):
+        self.count = 0
+        self.mean_x = 0.0
+        self.mean_y = 0.0
+        self.m2_x = 0.0
+        self.m2_y = 0.0
+        self.c_xy = 0.0
+
+    def update(self, x, y):
+        other = Comoments()
+        other.count = x.size
+        if other.count:
+            other.mean_x = float(np.mean(x, dtype=np.float64))
+            other.mean_y = float(np.mean(y, dtype=np.float64))
+            dx, dy = x - other.mean_x, y - other.mean_y
+            other.m2_x = float(np.sum(dx * dx, dtype=np.float64))
+            other.m2_y = float(np.sum(dy * dy, dtype=np.float64))
+            other.c_xy = float(np.sum(dx * dy, dtype=np.float64))
+        self.merge(other)
+
+    def merge(self, other):
+        count = self.count + other.count
+        if count:
+            dx = other.mean_x - self.mean_x
+            dy = other.mean_y - self.mean_y
+            weight = self.count * other.count / count
+            self.mean_x += dx * other.count / count
+            self.mean_y += dy * other.count / count
+            self.m2_x += other.m2_x + dx * dx * weight
+            self.m2_y += other.m2_y + dy * dy * weight
+            self.c_xy += other.c_xy + dx * dy * weight
+            self.count = count
+
+    @property
+    def correlation(self):
+        return self.c_xy / np.sqrt(self.m2_x * self.m2_y) if self.count > 1 else np.nan
+
+
+class Histogram:
+    # Counts over fixed bin edges, values outside the edges are counted apart
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) - 1, dtype=np.int64)
+        self.below = 0
+        self.above = 0
+
+    def update(self, values):
+        self.counts += np.histogram(values, self.edges)[0]
+        self.below += int(np.count_nonzero(values < self.edges[0]))
+        self.above += int(np.count_nonzero(values > self.edges[-1]))
+
+    def merge(self, other):
+        if not np.array_equal(self.edges, other.edges):
+            raise ValueError('Histograms have different bin edges')
+        self.counts += other.counts
+        self.below += other.below
+        self.above += other.above
+
+
+class KLLSketch:
+    # KLL quantile sketch (Karnin, Lang, Liberty 2016). Level h holds items of
+    # weight 2**h; a full level is sorted and every other item (random
+    # offset) is promoted. With k=200 the rank error of a quantile is about
+    # 1.65% with 99% confidence, independent of the number of values, and
+    # the sketch keeps O(k) items. Sketches of tiles or processes merge
+    # without losing that bound.
+
+    def __init__(self, k=200, seed=None):
+        self.k = k
+        self.count = 0
+        self.levels = [np.empty(0)]
+        self.rng = np.random.default_rng(seed)
+
+    def capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(np.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if items.size <= self.capacity(level):
+                level += 1
+                continue
+            if level + 1 == len(self.levels):
+                self.levels.append(np.empty(0))
+            items = np.sort(items)
+            even = items.size - items.size % 2
+            promoted = items[self.rng.integers(2):even:2]
+            self.levels[level] = items[even:]
+            self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+            # Capacities shrink as levels are added, start over from the bottom
+            level = 0
+
+    def update(self, values):
+        self.count += values.size
+        self.levels[0] = np.concatenate([self.levels[0], np.asarray(values, dtype=np.float64).ravel()])
+        self.compress()
+
+    def merge(self, other):
+        self.count += other.count
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self.compress()
+
+    def sorted_items(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(level.size, 2 ** h) for h, level in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantile(self, q):
+        if len(self.levels) == 1:
+            # Nothing compacted yet, so every value is still here
+            return np.quantile(self.levels[0], q) if self.count else np.nan
+        items, ranks = self.sorted_items()
+        if not items.size:
+            return np.nan
+        index = np.searchsorted(ranks, np.asarray(q) * ranks[-1], side='left')
+        return items[np.minimum(index, items.size - 1)]
+
+    def cdf(self, x):
+        items, ranks = self.sorted_items()
+        if not items.size:
+            return np.zeros_like(np.asarray(x, dtype=np.float64))
+        index = np.searchsorted(items, x, side='right')
+        return np.where(index > 0, ranks[np.maximum(index - 1, 0)], 0) / ranks[-1]
+
+
+class RasterSummary:
+    # Everything normal.py needs from a raster, filled in one pass and
+    # mergeable across tiles and worker processes
+
+    def __init__(self, edges=None, k=200, seed=None):
+        self.moments = Moments()
+        self.sketch = KLLSketch(k, seed)
+        self.histogram = Histogram(edges) if edges is not None else None
+        self.minimum = np.inf
+        self.maximum = -np.inf
+
+    def update(self, values):
+        if not values.size:
+            return
+        self.moments.update(values)
+        self.sketch.update(values)
+        if self.histogram is not None:
+            self.histogram.update(values)
+        self.minimum = min(self.minimum, float(values.min()))
+        self.maximum = max(self.maximum, float(values.max()))
+
+    def merge(self, other):
+        self.moments.merge(other.moments)
+        self.sketch.merge(other.sketch)
+        if self.histogram is not None:
+            self.histogram.merge(other.histogram)
+        self.minimum = min(self.minimum, other.minimum)
+        self.maximum = max(self.maximum, other.maximum)
+        return self
+
+    def quantile(self, q):
+        return self.sketch.quantile(q)
+
+
+def summarize_raster(raster_path, edges=None, block_size=1024, window=None, k=200):
+    summary = RasterSummary(edges, k)
+    for _, values, valid in iter_blocks(raster_path, block_size, window):
+        summary.update(values[valid])
+    return summary
+
+
+def histogram_raster(raster_path, edges, block_size=1024, window=None):
+    # Exact counts over fixed edges, e.g. a second pass once the edges
+    # depend on the mean and sd of a first one
+    histogram = Histogram(edges)
+    for _, values, valid in iter_blocks(raster_path, block_size, window):
+        histogram.update(values[valid])
+    return histogram
+
+
+def summarize_window(args):
+    return summarize_raster(*args)
+
+
+def summarize_parallel(raster_path, edges=None, block_size=1024, k=200, processes=None, tile_size=4096):
+    # Tiles are summarized in worker processes and their partial summaries
+    # merged here
+    import rasterio
+    with rasterio.open(raster_path) as raster:
+        tiles = list(block_windows(raster.width, raster.height, tile_size))
+    with ProcessPoolExecutor(processes) as pool:
+        parts = pool.map(summarize_window, [(raster_path, edges, block_size, tile, k) for tile in tiles])
+        summary = RasterSummary(edges, k)
+        for part in parts:
+            summary.merge(part)
+    return summary
@@ -1,26 +1,154 @@
+import glob
+import io
+import os
+import shutil
+import subprocess
 import sys
+import uuid
+from concurrent.futures import ProcessPoolExecutor
 
 
-def clean_file(input_path):
+class NullByteFilter(io.RawIOBase):
+    # Binary file-like wrapper that drops NUL bytes while it is read, so
+    # csv, pandas and anything else reading from it never see them and no
+    # _clean copy is needed. Reads are limited to chunk_size bytes.
+
+    def __init__(self, raw, chunk_size=1 << 20):
+        self.raw = raw
+        self.chunk_size = chunk_size
+        self.pending = b''
+        self.removed = 0
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self.pending:
+            chunk = self.raw.read(min(len(buffer), self.chunk_size))
+            if not chunk:
+                return 0
+            self.pending = chunk.replace(b'\x00', b'')
+            self.removed += len(chunk) - len(self.pending)
+        size = min(len(buffer), len(self.pending))
+        buffer[:size] = self.pending[:size]
+        self.pending = self.pending[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self.raw.close()
+        super().close()
+
+
+def open_clean(input_path, mode='r', encoding='utf-8', newline=None, chunk_size=1 << 20):
+    # open() for dirty files: 'rb' gives a buffered binary reader, 'r' a
+    # text reader, e.g. csv.reader(open_clean(path, newline='')) or
+    # pd.read_csv(open_clean(path, 'rb'))
+    reader = io.BufferedReader(NullByteFilter(open(input_path, 'rb'), chunk_size), chunk_size)
+    if mode == 'rb':
+        return reader
+    if mode != 'r':
+        raise ValueError(f'Unsupported mode: {mode}')
+    return io.TextIOWrapper(reader, encoding=encoding, newline=newline)
+
+
+def clean_vsimem(input_path, chunk_size=1 << 20, max_bytes=1 << 28):
+    # For OGR/QGIS, which cannot read Python file objects: the cleaned file
+    # is streamed into a GDAL /vsimem/ file with the same extension, usable
+    # as QgsVectorLayer(path, name, 'ogr') or ogr.Open(path). The whole
+    # cleaned file is held in RAM, so this is only for small files (up to
+    # max_bytes); convert large dumps with clean_translate, clean them to
+    # disk with clean_file or read them through open_clean. Release it with
+    # gdal.Unlink(path) when done.
+    if os.path.getsize(input_path) > max_bytes:
+        raise ValueError(f'{input_path} is larger than {max_bytes} bytes, use clean_translate, clean_file or open_clean')
+    from osgeo import gdal
+    path = f'/vsimem/{uuid.uuid4().hex}/{os.path.basename(input_path)}'
+    target = gdal.VSIFOpenL(path, 'wb')
     try:
-        output_path = input_path.replace('.', '_clean.')
-        with open(input_path, 'r', encoding='utf-8', errors='ignore') as file:
-            file_content = file.read()
+        with open_clean(input_path, 'rb', chunk_size=chunk_size) as source:
+            while True:
+                chunk = source.read(chunk_size)
+                if not chunk:
+                    break
+                gdal.VSIFWriteL(chunk, 1, len(chunk), target)
+    finally:
+        gdal.VSIFCloseL(target)
+    return path
+
 
-        clean_content = file_content.replace('\x00', '')
+def clean_translate(input_path, output_path, options=(), chunk_size=1 << 20):
+    # For dumps of any size: ogr2ogr reads the cleaned bytes from a pipe
+    # through /vsistdin/ and writes output_path, e.g. a .gpkg QGIS can open,
+    # so there is no _clean copy and memory stays at one chunk. OGR can only
+    # read stdin front to back (no feature count or rewind past the first
+    # MB), which ogr2ogr does. CSV needs the CSV: prefix as /vsistdin/ has
+    # no extension. options are extra ogr2ogr arguments, e.g.
+    # ['-oo', 'X_POSSIBLE_NAMES=lon', '-oo', 'Y_POSSIBLE_NAMES=lat'].
+    root, ext = os.path.splitext(os.path.basename(input_path))
+    source = 'CSV:/vsistdin/' if ext.lower() == '.csv' else '/vsistdin/'
+    command = ['ogr2ogr', '-nln', root, *options, output_path, source]
+    with open_clean(input_path, 'rb', chunk_size=chunk_size) as reader, \
+            subprocess.Popen(command, stdin=subprocess.PIPE) as process:
+        try:
+            shutil.copyfileobj(reader, process.stdin, chunk_size)
+        except BrokenPipeError:
+            # ogr2ogr stopped reading, its return code says why
+            pass
+        finally:
+            process.stdin.close()
+    if process.returncode != 0:
+        raise RuntimeError(f'ogr2ogr failed on {input_path} with return code {process.returncode}')
+    return output_path
 
-        with open(output_path, 'w', encoding='utf-8') as clean_file:
-            clean_file.write(clean_content)
-        print('Null bytes removed from file:', input_path)
+
+def clean_path(input_path):
+    # data/facilities.v2.csv -> data/facilities.v2_clean.csv
+    root, ext = os.path.splitext(input_path)
+    return f'{root}_clean{ext}'
+
+
+def clean_file(input_path, output_path=None, chunk_size=1 << 24):
+    # Copies the file without NUL bytes in fixed-size binary chunks, so
+    # memory stays at one chunk and every other byte is kept as it is.
+    # Returns the number of bytes removed.
+    if output_path is None:
+        output_path = clean_path(input_path)
+    with NullByteFilter(open(input_path, 'rb'), chunk_size) as file, open(output_path, 'wb') as clean_file:
+        shutil.copyfileobj(file, clean_file, chunk_size)
+        return file.removed
+
+
+def clean_one(input_path):
+    try:
+        return input_path, clean_file(input_path), None
     except Exception as e:
-        print(f'Error processing file {input_path}: {e}')
-        sys.exit(1)
+        return input_path, None, e
+
+
+def clean_files(input_paths, processes=None):
+    # Cleans every file in its own process, yields (path, removed, error)
+    if len(input_paths) == 1:
+        yield clean_one(input_paths[0])
+        return
+    with ProcessPoolExecutor(processes) as pool:
+        yield from pool.map(clean_one, input_paths)
 
 
 if __name__ == '__main__':
     if len(sys.argv) < 2:
-        print('Usage: python removenullbytes.py <file_path>')
+        print('Usage: python removenullbytes.py <file_path or glob> [...]')
         sys.exit(1)
     else:
-        input_path = sys.argv[1]
-        clean_file(input_path)
+        input_paths = []
+        for pattern in sys.argv[1:]:
+            input_paths.extend(sorted(glob.glob(pattern)) or [pattern])
+        failed = False
+        for input_path, removed, error in clean_files(input_paths):
+            if error is not None:
+                print(f'Error processing file {input_path}: {error}')
+                failed = True
+            else:
+                print(f'{removed} null bytes removed from file:', input_path)
+        if failed:
+            sys.exit(1)
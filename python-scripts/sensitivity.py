@@ -0,0 +1,144 @@
+import itertools
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+from scipy.ndimage import distance_transform_edt
+
+from costdistance import accumulated_cost, read_facilities
+from friction import LAYER_ORDER, SPEEDS
+
+# Shared inputs of the current worker process, see load_shared
+shared = {}
+
+
+def scenario_grid(speed_tables, class_filters, buffers):
+    # Every combination of speed table (class -> min/km), included road
+    # classes and study area buffer (km, None for no clip)
+    return [{'speeds': speeds, 'classes': classes, 'buffer': buffer}
+            for speeds, classes, buffer in itertools.product(speed_tables, class_filters, buffers)]
+
+
+def save_shared(workdir, arrays):
+    # Write the shared inputs once, workers memory-map them read-only
+    paths = {}
+    for name, array in arrays.items():
+        if array is None:
+            continue
+        paths[name] = os.path.join(workdir, f'{name}.npy')
+        np.save(paths[name], array)
+    return paths
+
+
+def load_shared(paths, rows, cols, cell_size, cube_path):
+    shared.clear()
+    shared.update({name: np.load(path, mmap_mode='r') for name, path in paths.items()})
+    shared.update(rows=rows, cols=cols, cell_size=cell_size,
+                  cube=np.load(cube_path, mmap_mode='r+'))
+
+
+def scenario_friction(speeds, classes, buffer):
+    distance = shared['distance']
+    friction = np.full(distance.shape, np.nan)
+    for name in LAYER_ORDER:
+        if name in classes:
+            friction[shared[name]] = speeds[name]
+    if buffer is not None:
+        friction[distance > buffer] = np.nan
+    return friction
+
+
+def zonal_summary(hours):
+    reached = np.isfinite(hours)
+    labels = shared['labels'][reached] if 'labels' in shared else np.zeros(reached.sum(), dtype=np.int64)
+    values = hours[reached]
+    counts = np.bincount(labels)
+    sums = np.bincount(labels, weights=values)
+    summary = {'zone': np.arange(len(counts)), 'pixels': counts}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        summary['mean_h'] = sums / counts
+        if 'population' in shared:
+            weights = np.nan_to_num(shared['population'][reached])
+            summary['population'] = np.bincount(labels, weights=weights, minlength=len(counts))
+            summary['pop_mean_h'] = np.bincount(labels, weights=weights * values, minlength=len(counts)) / summary['population']
+    return pd.DataFrame(summary)
+
+
+def run_scenario(index, scenario):
+    friction = scenario_friction(**scenario)
+    cost, _ = accumulated_cost(friction, shared['rows'], shared['cols'], shared['cell_size'])
+    hours = cost / 60
+    shared['cube'][index] = hours
+    summary = zonal_summary(hours)
+    summary.insert(0, 'scenario', index)
+    return summary
+
+
+def run_sweep(scenarios, classes, region, facility_rows, facility_cols, cell_size, workdir,
+              population=None, labels=None, processes=None):
+    # Builds the friction surface and travel time for every scenario across a
+    # process pool. Returns the (scenario, row, col) cube of travel time in
+    # hours as a memmap plus one zonal summary table for all scenarios.
+
+    # Distance (km) to the core region, buffers of every size are cut from it
+    distance = (distance_transform_edt(~region) * cell_size).astype(np.float32)
+    paths = save_shared(workdir, dict(classes, distance=distance, population=population, labels=labels))
+    cube_path = os.path.join(workdir, 'scenarios.npy')
+    cube = np.lib.format.open_memmap(cube_path, mode='w+', dtype=np.float32,
+                                     shape=(len(scenarios),) + region.shape)
+    del cube
+
+    initargs = (paths, facility_rows, facility_cols, cell_size, cube_path)
+    with ProcessPoolExecutor(processes, initializer=load_shared, initargs=initargs) as pool:
+        summaries = list(pool.map(run_scenario, range(len(scenarios)), scenarios))
+
+    return np.load(cube_path, mmap_mode='r'), pd.concat(summaries, ignore_index=True)
+
+
+def read_mask(raster_path):
+    import rasterio
+    with rasterio.open(raster_path) as raster:
+        data = raster.read(1, masked=True)
+        profile = raster.profile
+    return ~np.ma.getmaskarray(data) & (data.filled(0) != 0), profile
+
+
+def read_population(population_path, grid_path):
+    # Population counts on the grid of grid_path (the class rasters), so
+    # they can be indexed with the same masks. GHSL has its own grid; the
+    # counts are resampled with Resampling.sum, which keeps the totals.
+    import rasterio
+    from rasteralign import aligned_weights
+    from rasterreader import read_block
+    with rasterio.open(grid_path) as raster, aligned_weights(raster, population_path) as population:
+        values, valid = read_block(population, None, np.float64)
+    return np.where(valid, values, np.nan)
+
+
+if __name__ == "__main__":
+    class_paths = {'unpaved': 'unpaved.tif', 'paved': 'paved.tif', 'borders': 'borders.tif'}
+    region_path = 'region.tif'
+    population_path = 'ghsl.tif'
+    facilities_path = 'facilities.gpkg'
+    workdir = 'sensitivity'
+    save_path = 'sensitivity.csv'
+
+    speed_tables = [dict(SPEEDS, unpaved=unpaved, paved=paved)
+                    for paved, unpaved in [(1, 6), (1.5, 6), (1, 4), (2, 8), (1, 10)]]
+    class_filters = [('unpaved', 'paved', 'borders'), ('paved', 'borders')]
+    buffers = [None, 100, 150, 200, 250, 300]
+
+    os.makedirs(workdir, exist_ok=True)
+    classes = {}
+    for name, path in class_paths.items():
+        classes[name], profile = read_mask(path)
+    region, _ = read_mask(region_path)
+    population = read_population(population_path, region_path)
+    cell_size = abs(profile['transform'].a) / 1000
+    facilities, rows, cols = read_facilities(facilities_path, profile)
+
+    scenarios = scenario_grid(speed_tables, class_filters, buffers)
+    cube, summary = run_sweep(scenarios, classes, region, rows, cols, cell_size, workdir, population)
+    summary.to_csv(save_path, index=False)
+    print(f"{len(scenarios)} scenarios written to {workdir}/scenarios.npy")
@@ -0,0 +1,102 @@
+import numpy as np
+import shapely
+from shapely import STRtree
+
+# Extract by location predicates (feature <predicate> mask) as the STRtree
+# predicate of the mask against the indexed features
+PREDICATES = {'intersects': 'intersects',
+              'within': 'contains',
+              'contains': 'within',
+              'overlaps': 'overlaps',
+              'touches': 'touches',
+              'crosses': 'crosses'}
+
+
+class SpatialSelector:
+    # Extract by location, clip and difference against masks for several
+    # layers. Every layer gets one bulk loaded STRtree and every mask is
+    # dissolved and prepared once, however many steps use them.
+
+    def __init__(self, layers, masks):
+        self.layers = layers
+        self.masks = {}
+        for name, mask in masks.items():
+            geometry = mask if isinstance(mask, shapely.Geometry) else shapely.union_all(np.asarray(mask.geometry.values))
+            shapely.prepare(geometry)
+            self.masks[name] = geometry
+        self.trees = {}
+
+    def tree(self, layer):
+        if layer not in self.trees:
+            self.trees[layer] = STRtree(np.asarray(self.layers[layer].geometry.values))
+        return self.trees[layer]
+
+    def indices(self, layer, mask, predicate='intersects'):
+        # Positions of the features of layer that satisfy predicate, sorted
+        if predicate == 'disjoint':
+            hits = self.indices(layer, mask, 'intersects')
+            return np.setdiff1d(np.arange(len(self.layers[layer])), hits)
+        hits = self.tree(layer).query(self.masks[mask], predicate=PREDICATES[predicate])
+        return np.unique(hits)
+
+    def extract(self, layer, mask, predicate='intersects'):
+        return self.layers[layer].iloc[self.indices(layer, mask, predicate)]
+
+    def clip(self, layer, mask):
+        # Features inside the mask are kept as they are, only the ones
+        # crossing its boundary are intersected
+        selected = self.extract(layer, mask)
+        geometries = np.array(selected.geometry.values)
+        inside = shapely.contains_properly(self.masks[mask], geometries)
+        geometries[~inside] = shapely.intersection(geometries[~inside], self.masks[mask])
+        selected = selected.set_geometry(geometries, crs=selected.crs)
+        return selected[~shapely.is_empty(geometries)]
+
+    def difference(self, layer, mask):
+        result = self.layers[layer]
+        geometries = np.array(result.geometry.values)
+        hits = self.indices(layer, mask)
+        geometries[hits] = shapely.difference(geometries[hits], self.masks[mask])
+        result = result.set_geometry(geometries, crs=result.crs)
+        return result[~shapely.is_empty(geometries)]
+
+    def run(self, steps):
+        # steps maps an output name to (operation, layer, mask[, predicate]),
+        # e.g. {'bra': ('extract', 'bra_adm2', 'buffer', 'intersects')}.
+        # Outputs can be used as layers by later steps.
+        results = {}
+        for name, (operation, layer, mask, *predicate) in steps.items():
+            results[name] = getattr(self, operation)(layer, mask, *predicate)
+            self.layers[name] = results[name]
+        return results
+
+
+if __name__ == "__main__":
+    import geopandas as gpd
+    import pandas as pd
+
+    state_paths = {'arg': 'arg_adm2.gpkg', 'bra': 'bra_adm2.gpkg', 'pry': 'pry_adm2.gpkg'}
+    center = (-54.6, -25.5)
+    radius_in_meters = 300000
+    region_path = 'region.gpkg'
+    region_buffer_path = 'region_buffer.gpkg'
+
+    # region.model3: municipalities of the three countries touching the
+    # buffer around the center and touching twice the buffer
+    states = {name: gpd.read_file(path).to_crs('EPSG:3857') for name, path in state_paths.items()}
+    states = {name: layer.set_geometry(shapely.make_valid(np.asarray(layer.geometry.values)), crs=layer.crs)
+              for name, layer in states.items()}
+    center = gpd.GeoSeries(gpd.points_from_xy([center[0]], [center[1]]), crs='EPSG:4326').to_crs('EPSG:3857')[0]
+    masks = {'buffer': center.buffer(radius_in_meters), 'buffer2': center.buffer(radius_in_meters * 2)}
+
+    selector = SpatialSelector(states, masks)
+    steps = {}
+    for name in states:
+        steps[f'{name}_region'] = ('extract', name, 'buffer', 'intersects')
+        steps[f'{name}_region_buffer'] = ('extract', name, 'buffer2', 'intersects')
+    results = selector.run(steps)
+
+    region = pd.concat([results[f'{name}_region'] for name in states])
+    region_buffer = pd.concat([results[f'{name}_region_buffer'] for name in states])
+    region.dissolve().to_file(region_path)
+    region_buffer.dissolve().to_file(region_buffer_path)
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+import rasterio
+from rasterio.transform import from_origin
+from rasterio.warp import Resampling, calculate_default_transform, reproject
+
+pytest.importorskip('qgis.core')
+pytest.importorskip('osgeo.gdal')
+from qgis.core import (QgsApplication, QgsFeature, QgsGeometry, QgsPointXY, QgsProcessingContext,
+                       QgsProcessingFeedback, QgsProcessingUtils, QgsRasterLayer, QgsVectorLayer)
+
+from center_of_points import CenterOfPointsAlgorithm
+
+
+@pytest.fixture(scope='module')
+def qgis_app():
+    app = QgsApplication([], False)
+    app.initQgis()
+    yield app
+    app.exitQgis()
+
+
+def write_weights(path):
+    # 100 x 100 km in EPSG:3857 with a different weight in each quadrant
+    weights = np.ones((100, 100), dtype=np.float32)
+    weights[:50, 50:] = 2
+    weights[50:, :50] = 3
+    weights[50:, 50:] = 4
+    profile = {'driver': 'GTiff', 'height': 100, 'width': 100, 'count': 1, 'dtype': 'float32',
+               'crs': 'EPSG:3857', 'transform': from_origin(1000000, 6000000, 1000, 1000), 'nodata': -1}
+    with rasterio.open(path, 'w', **profile) as raster:
+        raster.write(weights, 1)
+
+
+def write_reprojected(path, reprojected_path):
+    # The same raster warped to EPSG:4326. The quadrant edges are a meridian
+    # and a parallel, so nearest neighbour keeps every quadrant whole.
+    with rasterio.open(path) as raster:
+        transform, width, height = calculate_default_transform(raster.crs, 'EPSG:4326', raster.width,
+                                                               raster.height, *raster.bounds)
+        profile = raster.profile | {'crs': 'EPSG:4326', 'transform': transform, 'width': width, 'height': height}
+        with rasterio.open(reprojected_path, 'w', **profile) as reprojected:
+            reproject(rasterio.band(raster, 1), rasterio.band(reprojected, 1), resampling=Resampling.nearest)
+
+
+def center(layer, raster_path):
+    algorithm = CenterOfPointsAlgorithm()
+    algorithm.initAlgorithm()
+    context = QgsProcessingContext()
+    parameters = {'INPUT': layer, 'WEIGHT_RASTER': QgsRasterLayer(raster_path, 'weights'), 'METHOD': 0,
+                  'OUTPUT': 'memory:'}
+    results, ok = algorithm.run(parameters, context, QgsProcessingFeedback())
+    assert ok
+    output = QgsProcessingUtils.mapLayerFromString(results['OUTPUT'], context)
+    feature = next(output.getFeatures())
+    return output.crs().authid(), feature.geometry().asPoint(), feature['weight']
+
+
+def test_weight_raster_in_another_crs(qgis_app, tmp_path):
+    write_weights(str(tmp_path / 'weights.tif'))
+    write_reprojected(str(tmp_path / 'weights.tif'), str(tmp_path / 'weights_4326.tif'))
+
+    # Points well inside the quadrants, in the CRS of the first raster
+    x = 1000000 + np.array([10500, 30500, 70500, 90500, 20500, 80500, 60500])
+    y = 6000000 - np.array([10500, 20500, 30500, 40500, 70500, 60500, 90500])
+    w = np.array([1, 1, 2, 2, 3, 4, 4])
+    layer = QgsVectorLayer('Point?crs=EPSG:3857', 'points', 'memory')
+    for px, py in zip(x, y):
+        feature = QgsFeature()
+        feature.setGeometry(QgsGeometry.fromPointXY(QgsPointXY(px, py)))
+        layer.dataProvider().addFeature(feature)
+
+    crs, same, weight = center(layer, str(tmp_path / 'weights.tif'))
+    assert crs == 'EPSG:3857'
+    assert weight == w.sum()
+    assert np.isclose(same.x(), np.sum(w * x) / w.sum())
+    assert np.isclose(same.y(), np.sum(w * y) / w.sum())
+
+    # Sampled in EPSG:4326, reduced and written in the CRS of the points
+    crs, other, weight = center(layer, str(tmp_path / 'weights_4326.tif'))
+    assert crs == 'EPSG:3857'
+    assert weight == w.sum()
+    assert np.isclose(other.x(), same.x(), rtol=0, atol=1e-6)
+    assert np.isclose(other.y(), same.y(), rtol=0, atol=1e-6)
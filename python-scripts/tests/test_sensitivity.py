@@ -0,0 +1,41 @@
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from sensitivity import read_population, run_sweep
+
+
+def write_raster(path, data, transform, nodata=None):
+    profile = {'driver': 'GTiff', 'height': data.shape[0], 'width': data.shape[1], 'count': 1,
+               'dtype': data.dtype, 'crs': 'EPSG:3857', 'transform': transform, 'nodata': nodata}
+    with rasterio.open(path, 'w', **profile) as raster:
+        raster.write(data, 1)
+
+
+def test_population_on_a_different_grid(tmp_path):
+    # Class grid: 40 x 30 pixels of 1 km. GHSL: 2 km pixels on a larger grid
+    # that covers it, like ghsl.tif against the friction surface.
+    grid_transform = from_origin(0, 40000, 1000, 1000)
+    region = np.zeros((40, 30), dtype=np.uint8)
+    region[18:22, 13:17] = 1
+    write_raster(tmp_path / 'region.tif', region, grid_transform)
+
+    population = np.arange(1, 27 * 22 + 1, dtype=np.float32).reshape(27, 22)
+    write_raster(tmp_path / 'ghsl.tif', population, from_origin(-4000, 44000, 2000, 2000), nodata=-1)
+
+    resampled = read_population(str(tmp_path / 'ghsl.tif'), str(tmp_path / 'region.tif'))
+    assert resampled.shape == region.shape
+    # Every 2 km pixel inside the grid is split over its four 1 km pixels
+    inside = population[2:22, 2:17]
+    assert np.isclose(resampled.sum(), inside.sum())
+    assert np.allclose(resampled[:2, :2], inside[0, 0] / 4)
+
+    classes = {'paved': np.ones(region.shape, dtype=bool)}
+    scenarios = [{'speeds': {'paved': 1}, 'classes': ('paved',), 'buffer': None}]
+    workdir = tmp_path / 'sweep'
+    workdir.mkdir()
+    cube, summary = run_sweep(scenarios, classes, region.astype(bool), np.array([20]), np.array([15]), 1.0,
+                              str(workdir), resampled, processes=1)
+    assert cube.shape == (1,) + region.shape
+    assert np.isclose(summary['population'].sum(), inside.sum())
+    assert np.isfinite(summary['pop_mean_h']).all()
@@ -0,0 +1,148 @@
+import numpy as np
+import pandas as pd
+
+from costdistance import solve_seeded, read_friction, write_raster
+
+
+def solve_window(friction, cost, allocation, bounds, cell_size, seed_cost=None):
+    # Seeded solve on a window of the full rasters; cost is in minutes with
+    # NaN for unreachable pixels.
+    r0, r1, c0, c1 = bounds
+    if seed_cost is None:
+        seed_cost = np.nan_to_num(cost[r0:r1, c0:c1], nan=np.inf)
+    return solve_seeded(friction[r0:r1, c0:c1], seed_cost, allocation[r0:r1, c0:c1], cell_size)
+
+
+def add_facility(friction, cost, allocation, row, col, facility_id, cell_size, margin=64):
+    # Only pixels the new facility is closer to can change. They form one
+    # connected patch around it, so solve a growing window seeded with the old
+    # costs until the improved patch no longer touches the window edge.
+    rows, cols = cost.shape
+    cost, allocation = cost.copy(), allocation.copy()
+    while True:
+        bounds = (max(row - margin, 0), min(row + margin + 1, rows),
+                  max(col - margin, 0), min(col + margin + 1, cols))
+        r0, r1, c0, c1 = bounds
+        seed_cost = np.nan_to_num(cost[r0:r1, c0:c1], nan=np.inf)
+        seed_alloc = allocation[r0:r1, c0:c1].copy()
+        if seed_cost[row - r0, col - c0] > 0:
+            seed_cost[row - r0, col - c0] = 0.0
+            seed_alloc[row - r0, col - c0] = facility_id
+        new_cost, new_alloc = solve_seeded(friction[r0:r1, c0:c1], seed_cost, seed_alloc, cell_size)
+
+        old_cost = np.nan_to_num(cost[r0:r1, c0:c1], nan=np.inf)
+        improved = new_cost < old_cost
+        edge = np.zeros_like(improved)
+        edge[0, :] = r0 > 0
+        edge[-1, :] = r1 < rows
+        edge[:, 0] |= c0 > 0
+        edge[:, -1] |= c1 < cols
+        if (improved & edge).any():
+            margin *= 2
+            continue
+
+        cost[r0:r1, c0:c1][improved] = new_cost[improved]
+        allocation[r0:r1, c0:c1][improved] = new_alloc[improved]
+        return cost, allocation, bounds
+
+
+def remove_facility(friction, cost, allocation, facility_id, cell_size):
+    # Only the old catchment of the facility changes. Everything around it
+    # keeps its cost and seeds the catchment again from its border.
+    catchment = allocation == facility_id
+    cost, allocation = cost.copy(), allocation.copy()
+    if not catchment.any():
+        return cost, allocation, None
+
+    rows, cols = cost.shape
+    hit_rows = np.flatnonzero(catchment.any(axis=1))
+    hit_cols = np.flatnonzero(catchment.any(axis=0))
+    bounds = (max(int(hit_rows[0]) - 1, 0), min(int(hit_rows[-1]) + 2, rows),
+              max(int(hit_cols[0]) - 1, 0), min(int(hit_cols[-1]) + 2, cols))
+    r0, r1, c0, c1 = bounds
+    inside = catchment[r0:r1, c0:c1]
+
+    seed_cost = np.nan_to_num(cost[r0:r1, c0:c1], nan=np.inf)
+    seed_cost[inside] = np.inf
+    new_cost, new_alloc = solve_window(friction, cost, allocation, bounds, cell_size, seed_cost)
+
+    cost[r0:r1, c0:c1][inside] = new_cost[inside]
+    allocation[r0:r1, c0:c1][inside] = new_alloc[inside]
+    return cost, allocation, bounds
+
+
+def zone_labels(zones_path, profile, id_field):
+    # Rasterize the zones once to a label raster (0 = no zone)
+    import geopandas as gpd
+    from rasterio.features import rasterize
+    zones = gpd.read_file(zones_path).to_crs(profile['crs'])
+    shapes = zip(zones.geometry, range(1, len(zones) + 1))
+    labels = rasterize(shapes, out_shape=(profile['height'], profile['width']),
+                       transform=profile['transform'], fill=0, dtype='int32')
+    return labels, zones[id_field].to_numpy()
+
+
+def delta_table(labels, zone_ids, old_cost, new_cost, bounds):
+    # Mean travel time in hours per zone before and after a change. Only the
+    # changed window is compared pixel by pixel, the zone means come from
+    # one bincount over the whole raster.
+    def zone_mean(cost):
+        reached = np.isfinite(cost)
+        sums = np.bincount(labels[reached], weights=cost[reached], minlength=len(zone_ids) + 1)
+        counts = np.bincount(labels[reached], minlength=len(zone_ids) + 1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return sums[1:] / counts[1:] / 60
+
+    changed = np.zeros(len(zone_ids) + 1, dtype=np.int64)
+    if bounds is not None:
+        r0, r1, c0, c1 = bounds
+        old, new = old_cost[r0:r1, c0:c1], new_cost[r0:r1, c0:c1]
+        differs = ~((old == new) | (np.isnan(old) & np.isnan(new)))
+        changed = np.bincount(labels[r0:r1, c0:c1][differs], minlength=len(zone_ids) + 1)
+
+    before, after = zone_mean(old_cost), zone_mean(new_cost)
+    table = pd.DataFrame({'zone': zone_ids,
+                          'changed_pixels': changed[1:],
+                          'before_h': before,
+                          'after_h': after,
+                          'delta_h': after - before})
+    return table[table['changed_pixels'] > 0].sort_values('delta_h')
+
+
+def read_traveltime(traveltime_path, allocation_path):
+    # Travel time rasters are stored in hours, the engine works in minutes
+    import rasterio
+    with rasterio.open(traveltime_path) as raster:
+        cost = raster.read(1, masked=True).astype(np.float64).filled(np.nan) * 60
+    with rasterio.open(allocation_path) as raster:
+        allocation = raster.read(1)
+    return cost, allocation
+
+
+if __name__ == "__main__":
+    friction_path = 'friction surface.tif'
+    traveltime_path = 'traveltime.tif'
+    allocation_path = 'allocation.tif'
+    facilities_path = 'facilities.gpkg'
+    municipalities_path = 'municipalities.gpkg'
+    municipality_field = 'shapeName'
+    save_path = 'whatif.csv'
+
+    # Scenario: open a clinic at (x, y) in the friction surface CRS
+    new_facility = (-6050000.0, -2900000.0)
+
+    friction, profile = read_friction(friction_path)
+    cell_size = abs(profile['transform'].a) / 1000
+    cost, allocation = read_traveltime(traveltime_path, allocation_path)
+    labels, zone_ids = zone_labels(municipalities_path, profile, municipality_field)
+
+    from rasterio.transform import rowcol
+    row, col = rowcol(profile['transform'], *new_facility)
+    # Allocation ids are facility fids, the new clinic gets the next free one
+    import geopandas as gpd
+    facility_id = int(gpd.read_file(facilities_path, fid_as_index=True, ignore_geometry=True).index.max()) + 1
+    new_cost, new_allocation, bounds = add_facility(friction, cost, allocation, row, col, facility_id, cell_size)
+
+    delta_table(labels, zone_ids, cost, new_cost, bounds).to_csv(save_path, index=False)
+    write_raster('traveltime_whatif.tif', new_cost / 60, profile, 'float32', np.nan)
+    write_raster('allocation_whatif.tif', new_allocation, profile, 'int32', -1)
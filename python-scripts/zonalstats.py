@@ -0,0 +1,167 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+import rasterio
+
+from rasteralign import aligned_weights, read_weights
+from rasterreader import block_windows, read_block
+from rasterstats import KLLSketch
+
+
+def grid_key(profile):
+    return repr((str(profile['crs']), tuple(profile['transform']), profile['height'], profile['width'])).encode()
+
+
+def cached_labels(zones_path, profile, cache_dir, id_field):
+    # Zone layer rasterized on the value grid as int32 labels (0 = no zone,
+    # i = i-th feature). The label raster is kept in cache_dir under a hash
+    # of the geometries and the grid, so it is only rebuilt when either
+    # changes. Where zones overlap the later feature wins.
+    import geopandas as gpd
+    from rasterio.features import rasterize
+    zones = gpd.read_file(zones_path).to_crs(profile['crs'])
+    digest = hashlib.sha1(grid_key(profile))
+    for wkb in zones.geometry.to_wkb():
+        digest.update(wkb)
+    name = os.path.splitext(os.path.basename(zones_path))[0]
+    path = os.path.join(cache_dir, f'{name}-{digest.hexdigest()[:16]}.npy')
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        shapes = zip(zones.geometry, range(1, len(zones) + 1))
+        labels = rasterize(shapes, out_shape=(profile['height'], profile['width']),
+                           transform=profile['transform'], fill=0, dtype='int32')
+        # Write under a temporary name so an interrupted run leaves no cache
+        np.save(path + '.tmp.npy', labels)
+        os.replace(path + '.tmp.npy', path)
+    return np.load(path, mmap_mode='r'), zones[id_field].to_numpy()
+
+
+class ZoneSums:
+    # Streaming count, sum and population sums of one zone layer, and with
+    # extremes=True the exact min and max
+
+    def __init__(self, nzones, extremes=False):
+        self.count = np.zeros(nzones + 1, dtype=np.int64)
+        self.sum = np.zeros(nzones + 1)
+        self.weight = np.zeros(nzones + 1)
+        self.weighted_sum = np.zeros(nzones + 1)
+        self.minimum = np.full(nzones + 1, np.inf) if extremes else None
+        self.maximum = np.full(nzones + 1, -np.inf) if extremes else None
+
+    def update(self, labels, values, weights=None):
+        size = len(self.count)
+        self.count += np.bincount(labels, minlength=size)
+        self.sum += np.bincount(labels, weights=values, minlength=size)
+        if weights is not None:
+            self.weight += np.bincount(labels, weights=weights, minlength=size)
+            self.weighted_sum += np.bincount(labels, weights=weights * values, minlength=size)
+        if self.minimum is not None:
+            np.minimum.at(self.minimum, labels, values)
+            np.maximum.at(self.maximum, labels, values)
+
+
+class ZoneSketches:
+    # One KLL sketch per zone for medians and quantiles. A zone with up to k
+    # valid pixels keeps all of them and is exact, a larger one has the
+    # sketch's rank error (about 1.65% for k=200). Memory is O(k) per zone
+    # whatever the raster size.
+
+    def __init__(self, nzones, k=200):
+        self.nzones = nzones
+        self.k = k
+        self.sketches = {}
+
+    def update(self, labels, values):
+        order = np.argsort(labels, kind='stable')
+        labels, values = labels[order], values[order]
+        starts = np.flatnonzero(np.r_[True, labels[1:] != labels[:-1]]) if labels.size else []
+        for zone, part in zip(labels[starts], np.split(values, starts[1:])):
+            if zone == 0:
+                continue
+            if zone not in self.sketches:
+                self.sketches[zone] = KLLSketch(self.k, seed=int(zone))
+            self.sketches[zone].update(part)
+
+    def quantile(self, q):
+        result = np.full(self.nzones, np.nan)
+        for zone, sketch in self.sketches.items():
+            result[zone - 1] = sketch.quantile(q)
+        return result
+
+
+def zonal_statistics(values_path, zone_layers, cache_dir, stats=('count', 'mean'), quantiles=(),
+                     weights_path=None, block_size=1024, k=200):
+    # Statistics of one value raster for several zone layers, like one
+    # native:zonalstatisticsfb per layer but with a single pass over the
+    # values. zone_layers maps a layer name to (zones path, id field).
+    # Everything is accumulated per block, memory stays at one block plus
+    # the per zone results: count, sum, mean, min, max and the population
+    # weighted mean ('pop_mean') are exact, median and quantiles come from
+    # one ZoneSketches per layer (exact for zones of up to k pixels).
+    with rasterio.open(values_path) as raster:
+        profile = raster.profile
+        layers = {name: cached_labels(path, profile, cache_dir, id_field)
+                  for name, (path, id_field) in zone_layers.items()}
+        extremes = 'min' in stats or 'max' in stats
+        sums = {name: ZoneSums(len(zone_ids), extremes) for name, (_, zone_ids) in layers.items()}
+        sketches = None
+        if 'median' in stats or len(quantiles) > 0:
+            sketches = {name: ZoneSketches(len(zone_ids), k) for name, (_, zone_ids) in layers.items()}
+
+        with aligned_weights(raster, weights_path) as weights_raster:
+            for window in block_windows(raster.width, raster.height, block_size):
+                values, valid = read_block(raster, window, np.float64)
+                weights = read_weights(weights_raster, window, valid)
+                rows, cols = window.toslices()
+                filtered = values[valid]
+                for name, (labels, _) in layers.items():
+                    block_labels = labels[rows, cols][valid]
+                    sums[name].update(block_labels, filtered, weights)
+                    if sketches is not None:
+                        sketches[name].update(block_labels, filtered)
+
+    tables = {}
+    for name, (labels, zone_ids) in layers.items():
+        zone = sums[name]
+        table = {'zone': zone_ids}
+        with np.errstate(invalid='ignore', divide='ignore'):
+            if 'count' in stats:
+                table['count'] = zone.count[1:]
+            if 'sum' in stats:
+                table['sum'] = zone.sum[1:]
+            if 'mean' in stats:
+                table['mean'] = zone.sum[1:] / zone.count[1:]
+            if 'pop_mean' in stats and weights_path:
+                table['population'] = zone.weight[1:]
+                table['pop_mean'] = zone.weighted_sum[1:] / zone.weight[1:]
+        empty = zone.count[1:] == 0
+        if 'min' in stats:
+            table['min'] = np.where(empty, np.nan, zone.minimum[1:])
+        if 'max' in stats:
+            table['max'] = np.where(empty, np.nan, zone.maximum[1:])
+        if 'median' in stats:
+            table['median'] = sketches[name].quantile(0.5)
+        for q in quantiles:
+            table[f'q{q:g}'] = sketches[name].quantile(q)
+        tables[name] = pd.DataFrame(table)
+    return tables
+
+
+if __name__ == "__main__":
+    traveltime_path = 'traveltime.tif'
+    population_path = 'ghsl.tif'
+    cache_dir = 'zone_labels'
+
+    # The zone layers of Analysis.model3
+    zone_layers = {'countries': ('countries.gpkg', 'shapeName'),
+                   'municipalities': ('municipalities.gpkg', 'shapeName'),
+                   'hexagons': ('hexagons.gpkg', 'id'),
+                   'indigenous_hexagons': ('indigenous_hexagons.gpkg', 'id')}
+
+    tables = zonal_statistics(traveltime_path, zone_layers, cache_dir,
+                              stats=('count', 'mean', 'median', 'pop_mean'), quantiles=(0.9,),
+                              weights_path=population_path)
+    for name, table in tables.items():
+        table.to_csv(f'{name}_traveltime.csv', index=False)